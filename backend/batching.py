@@ -0,0 +1,167 @@
+# batching.py
+"""
+- 查询侧 micro-batching：把并发的单条请求在几毫秒内攒成一批再发出
+- MicroBatchingEmbeddings：并发 embed_query -> 一次 embed_documents
+- BatchedVectorStore：并发检索 -> 一次 query_batch_points，接口与 similarity_search_with_score 相同
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Generic, List, Optional, Tuple, TypeVar
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client.http import models as qmodels
+
+from config import QUERY_BATCH_TIMEOUT_S
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    收集并发提交的 item，最多等待 max_wait_ms 或攒满 max_batch_size 条后调用一次 batch_fn，
+    再把结果按顺序分发回各个调用方。batch_fn 抛出的异常会传给这一批的所有调用方。
+    调用方最多等待 timeout 秒，超时抛出 TimeoutError（batch_fn 卡住时不会拖住所有查询）。
+    """
+    def __init__(
+        self,
+        batch_fn: Callable[[List[T]], List[R]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "micro-batcher",
+        timeout: float = QUERY_BATCH_TIMEOUT_S,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self.name = name
+        self._queue: "queue.Queue[Tuple[T, Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: T) -> R:
+        """提交一条请求并阻塞等待它所在批次的结果。"""
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((item, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise TimeoutError(f"{self.name}: no result within {self.timeout}s") from None
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: expected {len(items)} results, got {len(results)}")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """
+    包装任意 Embeddings：并发的 embed_query 被合并成一次 embed_documents 调用。
+    """
+    def __init__(
+        self, inner: Embeddings, max_batch_size: int = 32, max_wait_ms: float = 5.0, timeout: float = QUERY_BATCH_TIMEOUT_S
+    ):
+        self.inner = inner
+        self._batcher: MicroBatcher[str, List[float]] = MicroBatcher(
+            inner.embed_documents, max_batch_size, max_wait_ms, name="embed-batcher", timeout=timeout
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._batcher.submit(text)
+
+
+class BatchedVectorStore:
+    """
+    QdrantVectorStore 的查询侧包装：query embedding 与 Qdrant 检索都走 micro-batching。
+    其余属性/方法透传给被包装的 vector store。
+    """
+    def __init__(
+        self,
+        vector_store: QdrantVectorStore,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        timeout: float = QUERY_BATCH_TIMEOUT_S,
+    ):
+        self.vector_store = vector_store
+        self.batched_embeddings = MicroBatchingEmbeddings(vector_store.embeddings, max_batch_size, max_wait_ms, timeout)
+        self._search_batcher: MicroBatcher[Tuple[List[float], int, Optional[qmodels.Filter]], List[Any]] = MicroBatcher(
+            self._search_batch, max_batch_size, max_wait_ms, name="search-batcher", timeout=timeout
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.vector_store, name)
+
+    def _search_batch(self, requests: List[Tuple[List[float], int, Optional[qmodels.Filter]]]) -> List[List[Any]]:
+        vs = self.vector_store
+        responses = vs.client.query_batch_points(
+            collection_name=vs.collection_name,
+            requests=[
+                qmodels.QueryRequest(
+                    query=vector,
+                    using=vs.vector_name or None,
+                    filter=query_filter,
+                    limit=k,
+                    with_payload=True,
+                )
+                for vector, k, query_filter in requests
+            ],
+        )
+        return [response.points for response in responses]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[qmodels.Filter] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        vs = self.vector_store
+        points = self._search_batcher.submit((embedding, k, filter))
+        return [
+            (
+                QdrantVectorStore._document_from_point(
+                    point, vs.collection_name, vs.content_payload_key, vs.metadata_payload_key
+                ),
+                point.score,
+            )
+            for point in points
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[qmodels.Filter] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        embedding = self.batched_embeddings.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k=k, filter=filter, **kwargs)
@@ -0,0 +1,95 @@
+# benchmark_chunker.py
+"""
+对比 RecursiveCharacterTextSplitter.from_tiktoken_encoder 与 TokenChunker 的切分耗时。
+
+用法:
+  python benchmark_chunker.py                    # 合成约 20MB 文本
+  python benchmark_chunker.py --path knowledge_base --repeat 3
+"""
+from config import *
+import argparse
+import random
+import statistics
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from chunker import TokenChunker, get_encoder
+
+
+def synthetic_corpus(size_mb: float, seed: int = 0) -> List[Document]:
+    """生成带段落 / 句子结构的英文 + 中文混合文本，每个文档约 200KB。"""
+    rng = random.Random(seed)
+    words = ("vector", "search", "index", "payload", "tenant", "shard", "query", "embedding", "latency",
+             "throughput", "the", "a", "of", "and", "to", "in", "is", "检索", "向量", "索引", "分片")
+    docs, total, target = [], 0, int(size_mb * 1024 * 1024)
+    while total < target:
+        paragraphs = []
+        for _ in range(400):
+            sentences = [" ".join(rng.choice(words) for _ in range(rng.randint(6, 24))).capitalize() + "."
+                         for _ in range(rng.randint(2, 8))]
+            paragraphs.append(" ".join(sentences))
+        text = "\n\n".join(paragraphs)
+        docs.append(Document(page_content=text, metadata={"source": f"synthetic_{len(docs)}.txt"}))
+        total += len(text.encode("utf-8"))
+    return docs
+
+
+def load_corpus(path: Path) -> List[Document]:
+    docs = []
+    for file in sorted(path.rglob("*")):
+        if file.is_file() and file.suffix.lower() in (".txt", ".md"):
+            docs.append(Document(page_content=file.read_text(encoding="utf-8", errors="ignore"),
+                                 metadata={"source": file.name}))
+    return docs
+
+
+def run(name: str, split: Callable[[List[Document]], List[Document]], docs: List[Document], repeat: int) -> List[Document]:
+    timings, chunks = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = split(docs)
+        timings.append(time.perf_counter() - start)
+    mb = sum(len(d.page_content.encode("utf-8")) for d in docs) / 1024 / 1024
+    best = min(timings)
+    print(f"{name:<34} best {best:8.3f}s  median {statistics.median(timings):8.3f}s  "
+          f"{mb / best:7.2f} MB/s  {len(chunks)} chunks")
+    return chunks
+
+
+def describe(name: str, chunks: List[Document]) -> None:
+    encoder = get_encoder(CHUNK_ENCODING)
+    counts = [len(encoder.encode_ordinary(c.page_content)) for c in chunks]
+    if counts:
+        print(f"{name:<34} tokens/chunk: mean {statistics.mean(counts):.1f}  max {max(counts)}  "
+              f"over limit {sum(c > CHUNK_SIZE for c in counts)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chunking throughput.")
+    parser.add_argument("--path", type=Path, default=None, help="directory of .txt/.md files (default: synthetic corpus)")
+    parser.add_argument("--size-mb", type=float, default=20.0, help="synthetic corpus size")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    docs = load_corpus(args.path) if args.path else synthetic_corpus(args.size_mb)
+    print(f"Corpus: {len(docs)} docs, {sum(len(d.page_content) for d in docs) / 1024 / 1024:.1f}M chars, "
+          f"chunk_size={CHUNK_SIZE}, chunk_overlap={CHUNK_OVERLAP}, encoding={CHUNK_ENCODING}")
+    get_encoder(CHUNK_ENCODING)  # 预热，encoder 加载不计入切分耗时
+
+    def baseline(d: List[Document]) -> List[Document]:
+        splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name=CHUNK_ENCODING, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+        )
+        return splitter.split_documents(d)
+
+    def fast(d: List[Document]) -> List[Document]:
+        return TokenChunker(CHUNK_SIZE, CHUNK_OVERLAP).split_documents(d)
+
+    old_chunks = run("RecursiveCharacterTextSplitter", baseline, docs, args.repeat)
+    new_chunks = run("TokenChunker", fast, docs, args.repeat)
+    describe("RecursiveCharacterTextSplitter", old_chunks)
+    describe("TokenChunker", new_chunks)
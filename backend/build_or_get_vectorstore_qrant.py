@@ -4,11 +4,18 @@
 - 支持本地 in-memory / on-disk / server / cloud 多种部署方式
 - 支持 structured table -> payload 构造
 - 支持 metadata filter + 自定义 re-ranking（weighting）
+- 支持 parent-document（small-to-big）检索：子 chunk 入向量库，父段落入本地 docstore
+- 支持 multi-tenant：payload 中的 tenant_id（is_tenant 索引）分区，每个 tenant 独立目录与 manifest
+- memory / disk 模式可选 NumPy mmap 精确检索后端（LOCAL_VECTOR_BACKEND = "numpy"）
 """
 from config import *
+import hashlib
 import os
+import re
+import uuid
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Optional, Generator, Any
+from typing import List, Dict, Optional, Generator, Any, Sequence
 
 from langchain_community.document_loaders import (
     TextLoader,
@@ -17,11 +24,15 @@ from langchain_community.document_loaders import (
     CSVLoader,
     UnstructuredWordDocumentLoader,
 )
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_ollama import OllamaEmbeddings
 from langchain_core.documents import Document
 from qdrant_client.http import models as qmodels
 from langchain_qdrant import QdrantVectorStore, RetrievalMode
+from docstore import LocalDocStore
+from manifest import delete_manifest, list_manifests, load_manifest, save_manifest
+from numpy_store import NumpyVectorStore
+from chunker import TokenChunker, split_parent_child
+from ollama_pool import pooled_embeddings
+from sharding import ShardedVectorStore
 
 # qdrant client 用于 collection 创建与 filter models
 from qdrant_client import QdrantClient
@@ -31,12 +42,190 @@ from qdrant_client.http.models import (
     Filter,
     FieldCondition,
     MatchValue,
+    MatchAny,
     Range,
+    HnswConfigDiff,
+    KeywordIndexParams,
+    FilterSelector,
 )
 
 # ----------------- 配置 -----------------
 SCRIPT_DIR = Path(__file__).parent
 KNOWLEDGE_BASE_DIR = SCRIPT_DIR / "knowledge_base"
+TENANTS_DIR = KNOWLEDGE_BASE_DIR / "tenants"
+DOCSTORE_DIR = SCRIPT_DIR / "docstore"
+
+# ----------------- Tenant helpers -----------------
+_TENANT_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+TENANT_PAYLOAD_FIELD = f"metadata.{TENANT_PAYLOAD_KEY}"
+
+def validate_tenant_id(tenant_id: Optional[str]) -> str:
+    """校验 tenant ID（用作目录名和 payload 值），None 表示默认 tenant。"""
+    tenant_id = tenant_id or DEFAULT_TENANT
+    if tenant_id == "tenants" or not _TENANT_ID_RE.match(tenant_id):
+        raise ValueError(f"Invalid tenant id: {tenant_id!r}")
+    return tenant_id
+
+def get_tenant_dir(tenant_id: Optional[str] = None) -> Path:
+    """tenant 的知识库目录；默认 tenant 沿用 knowledge_base 根目录。"""
+    tenant_id = validate_tenant_id(tenant_id)
+    if tenant_id == DEFAULT_TENANT:
+        return KNOWLEDGE_BASE_DIR
+    return TENANTS_DIR / tenant_id
+
+def tenant_filter(tenant_id: Optional[str] = None, extra: Optional[List[Any]] = None) -> Filter:
+    """只命中该 tenant 分区的 Qdrant filter。"""
+    must = [FieldCondition(key=TENANT_PAYLOAD_FIELD, match=MatchValue(value=validate_tenant_id(tenant_id)))]
+    return Filter(must=must + list(extra or []))
+
+def get_docstore(tenant_id: Optional[str] = None) -> LocalDocStore:
+    """父段落 docstore（parent-document retrieval 模式下使用），每个 tenant 一个目录。"""
+    return _docstore_for(validate_tenant_id(tenant_id))
+
+@lru_cache(maxsize=None)
+def _docstore_for(tenant_id: str) -> LocalDocStore:
+    # 每次 parent 模式查询都会取 docstore，缓存实例避免重复 mkdir
+    return LocalDocStore(DOCSTORE_DIR / tenant_id)
+
+def _invalidate_all_tenants() -> List[str]:
+    """
+    共享的 collection / numpy store 被整体重建后，所有 tenant 的 points 都已不存在：
+    删除所有 manifest 并清空所有父段落，否则其它 tenant 下次增量同步会把文件都当作“未变化”跳过。
+    """
+    tenants = [m["tenant_id"] for m in list_manifests()]
+    for t in tenants:
+        delete_manifest(t)
+    if DOCSTORE_DIR.exists():
+        for directory in DOCSTORE_DIR.iterdir():
+            if directory.is_dir() and _TENANT_ID_RE.match(directory.name):
+                get_docstore(directory.name).clear()
+    return tenants
+
+def _ensure_tenant_index(client: QdrantClient) -> None:
+    """为 tenant_id 建立 is_tenant 的 keyword 索引（已存在时 Qdrant 直接忽略）。"""
+    try:
+        client.create_payload_index(
+            collection_name=QDRANT_COLLECTION,
+            field_name=TENANT_PAYLOAD_FIELD,
+            field_schema=KeywordIndexParams(type="keyword", is_tenant=True),
+        )
+    except Exception as e:
+        print(f"Warning while creating tenant payload index: {e}")
+
+def _purge_points(target: Any, tenant_id: str, sources: Optional[List[str]] = None) -> None:
+    """删除 tenant 的全部 points，或仅删除指定来源文件的 points（target 为 QdrantClient、NumpyVectorStore 或 ShardedVectorStore）。"""
+    extra = []
+    if sources:
+        extra.append(FieldCondition(key="metadata.source", match=MatchAny(any=list(sources))))
+    if isinstance(target, NumpyVectorStore):
+        target.delete_by_filter(tenant_filter(tenant_id, extra))
+        return
+    if isinstance(target, ShardedVectorStore):
+        for client in target.clients:
+            _purge_points(client, tenant_id, sources)
+        return
+    target.delete(
+        collection_name=QDRANT_COLLECTION,
+        points_selector=FilterSelector(filter=tenant_filter(tenant_id, extra)),
+    )
+
+def _parent_ids(entry: Dict[str, Any]) -> List[str]:
+    """manifest 条目记录的父段落 ID（由 parent_key_prefix 和父段落数重新生成）。"""
+    prefix = entry.get("parent_key_prefix")
+    return [_point_id(prefix, "parent", i) for i in range(entry.get("parents", 0))] if prefix else []
+
+def _purge_parents(docstore: LocalDocStore, files: Dict[str, Dict[str, Any]], keep: Sequence[str] = ()) -> int:
+    """
+    删除这些文件（旧版本）的父段落，keep 中的 ID（刚写入的新版本）保留。
+    旧版 manifest 条目没有 parent_key_prefix 时，按父段落 metadata.source 扫描 docstore。
+    """
+    stale = set()
+    legacy = set()
+    for name, entry in files.items():
+        if "parent_key_prefix" in entry:
+            stale.update(_parent_ids(entry))
+        else:
+            legacy.add(name)
+    if legacy:
+        for key in docstore.yield_keys():
+            doc = docstore.mget([key])[0]
+            if doc is not None and doc.metadata.get("source") in legacy:
+                stale.add(key)
+    stale.difference_update(keep)
+    docstore.mdelete(list(stale))
+    return len(stale)
+
+def _file_fingerprint(path: str) -> Dict[str, Any]:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _same_content(previous: Optional[Dict[str, Any]], fingerprint: Dict[str, Any], path: str) -> bool:
+    """
+    大小相同但 mtime 不同时比较内容哈希：从 snapshot 恢复后拷贝源文件（或 git checkout）通常只改变 mtime。
+    """
+    return (
+        bool(previous)
+        and previous.get("status", "complete") == "complete"
+        and previous.get("size") == fingerprint["size"]
+        and bool(previous.get("sha256"))
+        and _file_hash(path) == previous["sha256"]
+    )
+
+# ----------------- Client / collection helpers -----------------
+def get_backend(mode: str) -> str:
+    """memory / disk 模式可配置为 numpy 后端，其余都走 Qdrant。"""
+    return "numpy" if mode in ("memory", "disk") and LOCAL_VECTOR_BACKEND == "numpy" else "qdrant"
+
+def get_client(mode: str) -> QdrantClient:
+    if mode == "memory":
+        return QdrantClient(":memory:")
+    if mode == "disk":
+        return QdrantClient(path=QDRANT_PATH)
+    return QdrantClient(url=QDRANT_URL, prefer_grpc=True)
+
+def get_clients(mode: str) -> List[QdrantClient]:
+    """server 模式配置了 QDRANT_SHARD_URLS 时每个独立实例一个 client（客户端分片），否则只有一个。"""
+    if mode == "server" and QDRANT_SHARD_URLS:
+        return [QdrantClient(url=url, prefer_grpc=True) for url in QDRANT_SHARD_URLS]
+    return [get_client(mode)]
+
+def ensure_collection(client: QdrantClient, vector_size: int, mode: str) -> bool:
+    """collection 不存在时按统一配置创建，返回是否新建。"""
+    created = False
+    # 集群部署时的分片 / 副本设置；None 表示使用服务端默认值，本地模式没有分片概念
+    cluster_config = {}
+    if mode == "server":
+        cluster_config = {
+            key: value
+            for key, value in (
+                ("shard_number", QDRANT_SHARD_NUMBER),
+                ("replication_factor", QDRANT_REPLICATION_FACTOR),
+                ("write_consistency_factor", QDRANT_WRITE_CONSISTENCY_FACTOR),
+            )
+            if value is not None
+        }
+    try:
+        client.create_collection(
+            collection_name=QDRANT_COLLECTION,
+            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
+            # 所有查询都带 tenant filter：关闭全局图，按 tenant 构建 payload 子图
+            hnsw_config=HnswConfigDiff(m=0, payload_m=TENANT_HNSW_PAYLOAD_M),
+            **cluster_config,
+        )
+        created = True
+    except Exception:
+        pass
+    # 本地模式（memory/disk）不支持 payload 索引
+    if mode == "server":
+        _ensure_tenant_index(client)
+    return created
 
 # ----------------- Loader helpers -----------------
 def _is_structured_file(filename: str) -> bool:
@@ -101,28 +290,82 @@ def _load_generic_file(file_path: str) -> List[Document]:
         print(f"Failed to load {file_path}: {e}")
     return docs
 
+# ----------------- Splitting -----------------
+def _point_id(key_prefix: str, kind: str, index: int) -> str:
+    """确定性的 point / parent ID，中断后重跑同一批次会覆盖而不是重复写入。"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key_prefix}/{kind}/{index}"))
+
+def _split_documents(
+    docs: List[Document],
+    parent_document: bool,
+    docstore: Optional[LocalDocStore],
+    key_prefix: str,
+) -> List[Document]:
+    if parent_document:
+        return _split_parent_child(docs, docstore, key_prefix)
+    return TokenChunker(CHUNK_SIZE, CHUNK_OVERLAP).split_documents(docs)
+
+def _split_parent_child(docs: List[Document], docstore: LocalDocStore, key_prefix: str) -> List[Document]:
+    """
+    先切成较大的父段落并写入 docstore，再把每个父段落切成小的子 chunk。
+    子 chunk 的 metadata 里带 parent_id，检索命中后据此展开成父段落。
+    """
+    pairs = split_parent_child(
+        docs,
+        TokenChunker(PARENT_CHUNK_SIZE, PARENT_CHUNK_OVERLAP),
+        TokenChunker(CHILD_CHUNK_SIZE, CHILD_CHUNK_OVERLAP),
+    )
+
+    children: List[Document] = []
+    parent_pairs = []
+    # 没有子 chunk 的父段落永远不会被检索到，不写入 docstore（父段落 ID 保持从 0 连续编号）
+    pairs = [(parent, parent_children) for parent, parent_children in pairs if parent_children]
+    for index, (parent, parent_children) in enumerate(pairs):
+        parent_id = _point_id(key_prefix, "parent", index)
+        parent.metadata["parent_id"] = parent_id
+        parent_pairs.append((parent_id, parent))
+        for child in parent_children:
+            child.metadata["parent_id"] = parent_id
+            children.append(child)
+
+    docstore.mset(parent_pairs)
+    return children
+
 # ----------------- Build / load vectorstore -----------------
 def build_or_get_vectorstore(
     mode: str = "server",  # "memory", "disk", "server"
     recreate: bool = False,
     source_type: str = "all",
+    parent_document: Optional[bool] = None,
+    tenant_id: Optional[str] = None,
+    resume: bool = True,
 ) -> Generator[str, None, Optional[QdrantVectorStore]]:
     """
     mode:
       - memory: QdrantClient(":memory:") => ephemeral (good for dev)
       - disk: QdrantClient(path="/tmp/langchain_qdrant") => on-disk local storage
       - server: remote/local qdrant server via URL (http://localhost:6333) 或 Qdrant Cloud
+      - memory / disk 在 LOCAL_VECTOR_BACKEND = "numpy" 时改用 NumpyVectorStore（disk 存在 NUMPY_STORE_PATH）
+    parent_document:
+      - True: 子 chunk（CHILD_CHUNK_SIZE）入向量库，父段落（PARENT_CHUNK_SIZE）入 docstore
+      - None: 使用 config.PARENT_DOCUMENT_RETRIEVAL
+    tenant_id:
+      - 只扫描该 tenant 的目录，points 带 tenant_id payload；recreate 只清空该 tenant 的分区
+      - 非 memory 模式下按 manifest 增量同步：未变化的文件跳过，变化/删除的文件先清理旧 points
+    resume:
+      - 每个文件、每批 INGEST_BATCH_SIZE 个 chunk 提交后都写入 manifest checkpoint
+      - 上次 ingest 中途退出时，即使 recreate=True 也从最后提交的批次继续
     """
+    if parent_document is None:
+        parent_document = PARENT_DOCUMENT_RETRIEVAL
+    tenant_id = validate_tenant_id(tenant_id)
+
     # Embedding
-    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL_NAME)
+    embeddings = pooled_embeddings(EMBEDDING_MODEL_NAME)
 
     # Init client based on mode
-    if mode == "memory":
-        client = QdrantClient(":memory:")
-    elif mode == "disk":
-        client = QdrantClient(path=QDRANT_PATH)
-    else:
-        client = QdrantClient(url=QDRANT_URL)
+    backend = get_backend(mode)
+    clients = get_clients(mode) if backend == "qdrant" else []
 
     # Calculate vector size
     sample_vec = embeddings.embed_query("hello world")
@@ -130,106 +373,246 @@ def build_or_get_vectorstore(
         sample_vec = sample_vec[0]
     vector_size = len(sample_vec)
 
-    # Create collection if recreate True
-    try:
-        existing = None
-        try:
-            existing = client.get_collection(collection_name=QDRANT_COLLECTION)
-        except Exception:
-            cols = client.get_collections()
-            exists_list = getattr(cols, "collections", []) or []
-            if any(c.name == QDRANT_COLLECTION for c in exists_list):
-                existing = True
-
-        if recreate:
+    # Manifest / checkpoint: memory 模式每次都是空库，不读也不写；来自其他模式或切分方式的 manifest 不可信
+    persist_manifest = mode != "memory"
+    manifest = load_manifest(tenant_id) if persist_manifest else {"files": {}}
+    model_changed = (
+        manifest.get("embedding_model", EMBEDDING_MODEL_NAME) != EMBEDDING_MODEL_NAME
+        or manifest.get("vector_size", vector_size) != vector_size
+    )
+    if (
+        manifest.get("mode") not in (None, mode)
+        or manifest.get("backend", "qdrant") != backend
+        or manifest.get("parent_document", parent_document) != parent_document
+        or model_changed
+    ):
+        manifest = {"files": {}}
+    if model_changed:
+        # 该 tenant 的旧 points 是另一个模型的向量（维度相同也不可混用）：按 recreate 清空分区后重新 embedding
+        yield f"Embedding model changed for tenant '{tenant_id}', rebuilding its partition with {EMBEDDING_MODEL_NAME}."
+        recreate = True
+    # 上一次 ingest 中途退出（status == in_progress）时，从最后提交的批次继续，而不是清空重来
+    resuming = resume and persist_manifest and manifest.get("status") == "in_progress"
+
+    if backend == "numpy":
+        vector_store, reset = NumpyVectorStore.open(
+            embeddings,
+            vector_size,
+            path=NUMPY_STORE_PATH if mode == "disk" else None,
+            dtype=NUMPY_STORE_DTYPE,
+        )
+        if reset:
+            yield f"Warning: numpy store at '{NUMPY_STORE_PATH}' had a different vector size/dtype, recreated it."
+            manifest = {"files": {}}
+            resuming = False
+            if persist_manifest:
+                dropped = _invalidate_all_tenants()
+                yield f"Reset ingest manifests of all tenants: {dropped}"
+        if recreate and not resuming:
+            _purge_points(vector_store, tenant_id)
+            yield f"Cleared tenant '{tenant_id}' from numpy store."
+        purge_target: Any = vector_store
+    else:
+        # Create collection if missing (on every shard); recreate only clears this tenant's partition
+        for shard, client in enumerate(clients):
+            label = f"'{QDRANT_COLLECTION}'" + (f" on shard {shard}" if len(clients) > 1 else "")
             try:
-                client.delete_collection(collection_name=QDRANT_COLLECTION)
-            except Exception:
-                pass
+                existing = None
+                try:
+                    existing = client.get_collection(collection_name=QDRANT_COLLECTION)
+                except Exception:
+                    cols = client.get_collections()
+                    exists_list = getattr(cols, "collections", []) or []
+                    if any(c.name == QDRANT_COLLECTION for c in exists_list):
+                        existing = True
 
-        # If collection doesn't exist, create it with VectorParams
-        try:
-            client.create_collection(
+                # 向量维度变化（换了 embedding 模型）时，所有 tenant 的数据都已不可用，只能整体重建
+                existing_size = getattr(getattr(getattr(getattr(existing, "config", None), "params", None), "vectors", None), "size", None)
+                if existing_size is not None and existing_size != vector_size:
+                    yield f"Warning: collection vector size {existing_size} != {vector_size}, dropping {label}."
+                    client.delete_collection(collection_name=QDRANT_COLLECTION)
+                    existing = None
+                    manifest = {"files": {}}
+                    resuming = False
+                    if persist_manifest:
+                        dropped = _invalidate_all_tenants()
+                        yield f"Reset ingest manifests of all tenants: {dropped}"
+
+                if existing and recreate and not resuming:
+                    try:
+                        _purge_points(client, tenant_id)
+                        yield f"Cleared tenant '{tenant_id}' from collection {label}."
+                    except Exception as e:
+                        print(f"Warning while clearing tenant '{tenant_id}': {e}")
+
+                # If collection doesn't exist, create it with VectorParams
+                if ensure_collection(client, vector_size, mode):
+                    yield f"Created collection {label} (size={vector_size})."
+                else:
+                    yield f"Collection {label} already exists."
+            except Exception as e:
+                print(f"Warning while creating/inspecting collection: {e}")
+
+    docstore = get_docstore(tenant_id) if parent_document else None
+    if recreate and not resuming:
+        manifest = {"files": {}}
+        if docstore is not None:
+            docstore.clear()
+    manifest.update({
+        "mode": mode,
+        "collection": QDRANT_COLLECTION,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "vector_size": vector_size,
+        "backend": backend,
+        "parent_document": parent_document,
+        "status": "in_progress",
+    })
+    manifest_files: Dict[str, Any] = manifest.setdefault("files", {})
+
+    def checkpoint() -> None:
+        if persist_manifest:
+            save_manifest(tenant_id, manifest)
+
+    checkpoint()
+    if resuming:
+        done = sum(1 for f in manifest_files.values() if f.get("status") == "complete")
+        yield f"Resuming interrupted ingest for tenant '{tenant_id}': {done} file(s) already complete."
+
+    if backend == "qdrant":
+        # from_documents 不接受现成的 client（会被当作连接参数），直接包装已创建的 collection
+        shards = [
+            QdrantVectorStore(
+                client=client,
                 collection_name=QDRANT_COLLECTION,
-                vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
+                embedding=embeddings,
+                retrieval_mode=RetrievalMode.DENSE,
             )
-            yield f"Created collection '{QDRANT_COLLECTION}' (size={vector_size})."
-        except Exception:
-            yield f"Collection '{QDRANT_COLLECTION}' already exists."
-            pass
-    except Exception as e:
-        print(f"Warning while creating/inspecting collection: {e}")
+            for client in clients
+        ]
+        # 多个独立实例：按 source 分片写入，查询 scatter-gather
+        if len(shards) > 1:
+            vector_store = ShardedVectorStore(shards, embeddings, max_workers=QDRANT_SHARD_SEARCH_WORKERS)
+            yield f"Sharding points by source across {len(shards)} Qdrant instances."
+        else:
+            vector_store = shards[0]
+        purge_target = vector_store if len(shards) > 1 else clients[0]
 
-    # Scan and load documents
-    docs_to_index: List[Document] = []
-    dirs_to_scan = [KNOWLEDGE_BASE_DIR]
+    # Scan, split and index file by file; each committed batch is checkpointed in the manifest
+    dirs_to_scan = [get_tenant_dir(tenant_id)]
+    seen_files = set()
+    indexed_chunks = 0
 
     for directory in dirs_to_scan:
         if not os.path.exists(directory):
             yield f"Warning: Directory '{directory}' not found, skipping."
             continue
 
-        yield f"Scanning files in '{directory}'..."
-        for filename in os.listdir(directory):
+        yield f"Scanning files in '{directory}' (tenant '{tenant_id}')..."
+        for filename in sorted(os.listdir(directory)):
             path = os.path.join(directory, filename)
-            if os.path.isfile(path):
-                if _is_structured_file(filename):
-                    loaded = _load_csv_table_as_documents(path)
-                else:
-                    loaded = _load_generic_file(path)
-                
-                if loaded:
-                    docs_to_index.extend(loaded)
-                    yield f"Loaded {len(loaded)} docs from {filename}"
+            if not os.path.isfile(path):
+                continue
+            seen_files.add(filename)
+            fingerprint = _file_fingerprint(path)
+            previous = manifest_files.get(filename)
+            unchanged = bool(previous) and previous.get("size") == fingerprint["size"] and previous.get("mtime") == fingerprint["mtime"]
+            if unchanged and previous.get("status", "complete") == "complete":
+                yield f"Unchanged, skipping {filename}"
+                continue
+            if not unchanged and _same_content(previous, fingerprint, path):
+                # 内容没变：只更新指纹；本地已有源文件，不再是 snapshot 条目
+                previous["mtime"] = fingerprint["mtime"]
+                previous.pop("snapshot", None)
+                checkpoint()
+                yield f"Unchanged content (only mtime differs), skipping {filename}"
+                continue
 
-    if not docs_to_index:
-        yield "No new documents to index."
-    else:
-        # Split into chunks
-        splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
-        )
-        splits = splitter.split_documents(docs_to_index)
-        yield "Splitting documents into chunks..."
-        yield f"Total chunks: {len(splits)}"
-
-        # Use LangChain wrapper to create/populate vector store
-        if mode == "memory" or mode == "disk":
-            vector_store = QdrantVectorStore.from_documents(
-                splits,
-                embeddings,
-                client=client,
-                collection_name=QDRANT_COLLECTION,
-                retrieval_mode=RetrievalMode.DENSE,
-            )
-        else:
-            vector_store = QdrantVectorStore.from_documents(
-                splits,
-                embeddings,
-                url=QDRANT_URL,
-                collection_name=QDRANT_COLLECTION,
-                prefer_grpc=True,
-                retrieval_mode=RetrievalMode.DENSE,
-            )
-        yield "Vector store populated."
-        return vector_store
+            if _is_structured_file(filename):
+                loaded = _load_csv_table_as_documents(path)
+            else:
+                loaded = _load_generic_file(path)
+            if not loaded:
+                continue
+            for doc in loaded:
+                doc.metadata[TENANT_PAYLOAD_KEY] = tenant_id
+            yield f"Loaded {len(loaded)} docs from {filename}"
 
-    # If no docs indexed, attempt to return wrapper around existing collection
-    try:
-        if mode == "memory" or mode == "disk":
-            vec = QdrantVectorStore(
-                client=client,
-                collection_name=QDRANT_COLLECTION,
-                embedding=embeddings,
-            )
-        else:
-            vec = QdrantVectorStore.from_documents(
-                [], embeddings, url=QDRANT_URL, collection_name=QDRANT_COLLECTION
-            )
-        return vec
-    except Exception as e:
-        print(f"Failed to build vectorstore wrapper: {e}")
-        return None
+            # 切分是确定性的，chunk / parent ID 由文件指纹和序号生成，重跑同一批次只会覆盖相同的 points
+            key_prefix = f"{tenant_id}/{filename}/{fingerprint['size']}-{fingerprint['mtime']}"
+            splits = _split_documents(loaded, parent_document, docstore, key_prefix)
+            parent_ids = list(dict.fromkeys(d.metadata["parent_id"] for d in splits)) if docstore is not None else []
+            batches_total = (len(splits) + INGEST_BATCH_SIZE - 1) // INGEST_BATCH_SIZE
+
+            batches_done = 0
+            if unchanged and previous.get("chunks") == len(splits):
+                batches_done = previous.get("batches_done", 0)
+            elif previous:
+                # 文件已变化（或切分结果不同）：先清理旧 points 和旧父段落
+                try:
+                    _purge_points(purge_target, tenant_id, [filename])
+                    if docstore is not None:
+                        _purge_parents(docstore, {filename: previous}, keep=parent_ids)
+                except Exception as e:
+                    print(f"Warning while removing stale chunks for {filename}: {e}")
+
+            entry = {
+                **fingerprint,
+                "sha256": _file_hash(path),
+                "docs": len(loaded),
+                "chunks": len(splits),
+                "batches_total": batches_total,
+                "batches_done": batches_done,
+                "status": "partial",
+            }
+            if docstore is not None:
+                entry.update({"parent_key_prefix": key_prefix, "parents": len(parent_ids)})
+            manifest_files[filename] = entry
+            checkpoint()
+            if batches_done:
+                yield f"Resuming {filename} from batch {batches_done + 1}/{batches_total}"
+            else:
+                yield f"Split {filename} into {len(splits)} chunks ({batches_total} batches)"
+
+            for batch_index in range(batches_done, batches_total):
+                start = batch_index * INGEST_BATCH_SIZE
+                batch = splits[start:start + INGEST_BATCH_SIZE]
+                ids = [_point_id(key_prefix, "chunk", start + i) for i in range(len(batch))]
+                vector_store.add_documents(batch, ids=ids)
+                entry["batches_done"] = batch_index + 1
+                checkpoint()
+                indexed_chunks += len(batch)
+                yield f"{filename}: batch {batch_index + 1}/{batches_total} committed"
+
+            entry["status"] = "complete"
+            checkpoint()
+
+    # 目录中已删除的文件：清理旧 points（从 snapshot 恢复、本地还没有源文件的条目保留）
+    removed = [
+        name for name, entry in list(manifest_files.items())
+        if name not in seen_files and not entry.get("snapshot")
+    ]
+    if removed:
+        try:
+            _purge_points(purge_target, tenant_id, removed)
+            if docstore is not None:
+                _purge_parents(docstore, {name: manifest_files[name] for name in removed})
+            yield f"Removed stale chunks for {len(removed)} file(s)."
+        except Exception as e:
+            print(f"Warning while removing stale chunks: {e}")
+        for name in removed:
+            manifest_files.pop(name, None)
+
+    manifest["status"] = "complete"
+    checkpoint()
+    if backend == "numpy" and vector_store.count > 2 * vector_store.live_count():
+        vector_store.compact()
+        yield f"Compacted numpy store to {vector_store.count} live rows."
+    if indexed_chunks:
+        yield f"Total chunks indexed: {indexed_chunks}"
+        yield "Vector store populated."
+    else:
+        yield "No new documents to index."
+    return vector_store
 
 # ----------------- re-ranking and custom scoring  -----------------
 def semantic_search_with_custom_scoring(
@@ -240,17 +623,31 @@ def semantic_search_with_custom_scoring(
     filter_file_types: Optional[List[str]] = None,
     weight_sim: float = 0.7,
     weight_payload: float = 0.3,
+    docstore: Optional[LocalDocStore] = None,
+    tenant_id: Optional[str] = None,
+    query_vector: Optional[List[float]] = None,
 ) -> List[dict]:
     """
     使用 vector_store.similarity_search_with_score 并结合自定义 payload 加分重排序。
     修复了过滤器参数问题。
+    传入 docstore 时，命中的子 chunk 会按 parent_id 展开并去重为父段落。
+    检索只在 tenant_id 对应的分区内进行。
+    已有 query_vector（例如会话中已算过）且 vector store 支持按向量检索时，不再重复 embedding。
     """
     try:
         # 先获取更大的候选集，然后进行过滤和重排序
-        results_with_score = vector_store.similarity_search_with_score(
-            query=query,
-            k=top_k * 4  # 获取更多候选结果
-        )
+        if query_vector is not None and hasattr(vector_store, "similarity_search_with_score_by_vector"):
+            results_with_score = vector_store.similarity_search_with_score_by_vector(
+                query_vector,
+                k=top_k * 4,
+                filter=tenant_filter(tenant_id),
+            )
+        else:
+            results_with_score = vector_store.similarity_search_with_score(
+                query=query,
+                k=top_k * 4,  # 获取更多候选结果
+                filter=tenant_filter(tenant_id),
+            )
         print(f"  > 原始检索到 {len(results_with_score)} 个结果。")
 
         # 如果有文件类型过滤要求，在Python层面进行过滤
@@ -290,7 +687,10 @@ def semantic_search_with_custom_scoring(
             scored.append({"doc": doc, "score": score, "payload": payload, "combined": combined})
 
         # 按综合得分排序并返回top_k结果
-        scored_sorted = sorted(scored, key=lambda x: x["combined"], reverse=True)[:top_k]
+        scored_sorted = sorted(scored, key=lambda x: x["combined"], reverse=True)
+        if docstore is not None:
+            scored_sorted = _expand_to_parents(scored_sorted, docstore)
+        scored_sorted = scored_sorted[:top_k]
         # Informational message; use print instead of yield to avoid making this function a generator
         print(f"Found {str(scored_sorted)} results after custom scoring.")
         return scored_sorted
@@ -299,6 +699,28 @@ def semantic_search_with_custom_scoring(
         print(f"Error in semantic_search_with_custom_scoring: {e}")
         return []
 
+def _expand_to_parents(scored: List[dict], docstore: LocalDocStore) -> List[dict]:
+    """
+    把已排序的子 chunk 结果替换为父段落，同一父段落只保留得分最高的一条。
+    没有 parent_id（或 docstore 中缺失）的结果原样保留。
+    """
+    parent_ids = [r["payload"].get("parent_id") for r in scored]
+    unique_ids = list(dict.fromkeys(pid for pid in parent_ids if pid))
+    parents = dict(zip(unique_ids, docstore.mget(unique_ids))) if unique_ids else {}
+
+    expanded = []
+    seen = set()
+    for result, parent_id in zip(scored, parent_ids):
+        parent = parents.get(parent_id) if parent_id else None
+        if parent is None:
+            expanded.append(result)
+            continue
+        if parent_id in seen:
+            continue
+        seen.add(parent_id)
+        expanded.append({**result, "doc": parent, "payload": parent.metadata, "child_doc": result["doc"]})
+    return expanded
+
 # ----------------- 示例运行 -----------------
 if __name__ == "__main__":
     # Choose mode
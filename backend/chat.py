@@ -1,15 +1,33 @@
 # chat.py
-import ollama
-from langchain_ollama import ChatOllama
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.messages import AIMessage, HumanMessage
 import sys
 from typing import List, Tuple, Optional
+from config import (
+    DEFAULT_TENANT,
+    PARENT_DOCUMENT_RETRIEVAL,
+    QUERY_BATCHING,
+    QUERY_BATCH_MAX_SIZE,
+    QUERY_BATCH_MAX_WAIT_MS,
+    QDRANT_SHARD_SEARCH_WORKERS,
+    SESSION_MAX_SESSIONS,
+    SESSION_MAX_TURNS,
+    SESSION_TTL_SECONDS,
+    SESSION_HISTORY_TURNS,
+    SESSION_REUSE_THRESHOLD,
+)
+from batching import BatchedVectorStore, MicroBatchingEmbeddings
+from sharding import ShardedVectorStore
+from ollama_pool import get_pool, pooled_chat
+from langchain_qdrant import QdrantVectorStore
+from sessions import SessionStore, Session, Turn, cosine_similarity
 
 # 导入修复后的函数
 try:
     from build_or_get_vectorstore_qrant import (
         build_or_get_vectorstore,
-        semantic_search_with_custom_scoring
+        semantic_search_with_custom_scoring,
+        get_docstore,
     )
 except ImportError as e:
     print(f" Import error: {e}")
@@ -19,19 +37,20 @@ except ImportError as e:
 # Check if the specified model exists in the local Ollama installation
 def check_model_exists(model_name: str) -> None:
     """
-    Checks Ollama status and model availability.
+    Checks that the Ollama endpoints are up and that at least one of them has the model.
     """
-    try:
-        # First, get the data. We'll print messages after confirming the status.
-        response = ollama.list()
-        installed_models = [m.model for m in response.models]
-    except Exception as e:
+    # Ask every healthy endpoint in the pool (RAG_OLLAMA_ENDPOINTS / OLLAMA_HOST) for its models.
+    pool = get_pool()
+    models_by_endpoint = pool.list_models()
+    if not models_by_endpoint:
         # Handles connection error
-        print(" Error: Could not connect to Ollama.")
+        print(" Error: Could not connect to any Ollama endpoint.")
         print("Please ensure the Ollama application or server is running.")
-        print(f"Connection error details: {e}")
+        for ep in pool.stats():
+            print(f"  ✗ {ep['url']}: {ep['last_error']}")
         sys.exit(1)
 
+    installed_models = sorted(set().union(*models_by_endpoint.values()))
     if not installed_models:
         print(" No Ollama models found!")
         print("You can pull a model using the command line, for example:")
@@ -41,16 +60,20 @@ def check_model_exists(model_name: str) -> None:
     # If models exist, list them
     print(" Installed Ollama models:")
     for model in installed_models:
-        print(f"  ✓ {model}")
+        hosts = [url for url, models in models_by_endpoint.items() if model in models]
+        print(f"  ✓ {model} ({', '.join(hosts)})")
     print("-" * 40)
 
-    # Check if the specific model is in our list
+    # Check if the specific model is on at least one endpoint
     if model_name not in installed_models:
         print(f" Error: Model '{model_name}' is not installed.")
         print("Please install it using the following command:")
         print(f"  ollama pull {model_name}")
         sys.exit(1)
     else:
+        missing = [url for url, models in models_by_endpoint.items() if model_name not in models]
+        if missing:
+            print(f" Warning: Model '{model_name}' is missing on {', '.join(missing)}; requests routed there will fail.")
         print(f" Model '{model_name}' is available. Proceeding...")
 
 
@@ -117,10 +140,24 @@ class QdrantRAGChain:
     """
     Custom RAG chain using Qdrant vector store with custom scoring.
     """
-    def __init__(self, vectorstore, llm, preferred_sources: Optional[List[str]] = None):
+    def __init__(
+        self,
+        vectorstore,
+        llm,
+        preferred_sources: Optional[List[str]] = None,
+        parent_document: bool = False,
+        session_store: Optional[SessionStore] = None,
+    ):
         self.vectorstore = vectorstore
         self.llm = llm
         self.preferred_sources = preferred_sources or []
+        # parent-document 模式下用 tenant 的 docstore 把子 chunk 展开为父段落
+        self.parent_document = parent_document
+        self.sessions = session_store or SessionStore(
+            max_sessions=SESSION_MAX_SESSIONS,
+            max_turns=SESSION_MAX_TURNS,
+            ttl_seconds=SESSION_TTL_SECONDS,
+        )
         # self.filter_file_types = None
         
         self.prompt = ChatPromptTemplate.from_template("""
@@ -141,6 +178,26 @@ class QdrantRAGChain:
 
         ANSWER:
         """)
+
+        # 会话模式：说明 + 上下文固定放在 system 消息里，历史轮次在后，最新问题在最后。
+        # 复用上下文时前缀完全不变，Ollama 可以直接复用已计算的 KV/prompt cache。
+        self.session_prompt = ChatPromptTemplate.from_messages([
+            ("system", """You are an expert AI assistant that provides comprehensive answers based on the provided context documents.
+
+        INSTRUCTIONS:
+        1. Use the context documents below to answer the question thoroughly
+        2. If information is found in multiple documents, synthesize the information coherently
+        3. Cite the source documents when possible (e.g., "According to [Document Name]...")
+        4. If the information is not available in the context, clearly state this
+        5. Provide detailed, well-structured answers
+        6. When dealing with technical topics, explain concepts clearly
+        7. Use the earlier conversation turns to resolve follow-up questions
+
+        CONTEXT DOCUMENTS:
+        {context}"""),
+            MessagesPlaceholder("history"),
+            ("human", "{input}"),
+        ])
     # static method to set file filters
     '''
     def set_file_filters(self, filter_types: Optional[List[str]] = None):
@@ -149,9 +206,16 @@ class QdrantRAGChain:
         if filter_types:
             print(f" File filters set: {', '.join(filter_types)}")
     '''
-    def retrieve_documents(self, query: str, top_k: int = 6, file_filters: Optional[List[str]] = None) -> List[dict]:
+    def retrieve_documents(
+        self,
+        query: str,
+        top_k: int = 6,
+        file_filters: Optional[List[str]] = None,
+        tenant_id: Optional[str] = None,
+        query_vector: Optional[List[float]] = None,
+    ) -> List[dict]:
         """
-        Retrieve documents using custom scoring.
+        Retrieve documents using custom scoring, restricted to the tenant's partition.
         """
         try:
             return semantic_search_with_custom_scoring(
@@ -161,22 +225,77 @@ class QdrantRAGChain:
                 preferred_sources=self.preferred_sources,
                 filter_file_types=file_filters,
                 weight_sim=0.7,
-                weight_payload=0.3
+                weight_payload=0.3,
+                docstore=get_docstore(tenant_id) if self.parent_document else None,
+                tenant_id=tenant_id,
+                query_vector=query_vector,
             )
         except Exception as e:
             print(f"Error during document retrieval: {e}")
             return []
+
+    def _embed_query(self, query: str) -> List[float]:
+        # 开启 query batching 时走 micro-batching 的 embedder
+        embeddings = getattr(self.vectorstore, "batched_embeddings", None) or self.vectorstore.embeddings
+        return embeddings.embed_query(query)
+
+    def _reusable_results(
+        self,
+        session: Session,
+        query_vector: List[float],
+        top_k: int,
+        file_filters: Optional[List[str]],
+        tenant_id: Optional[str],
+    ) -> Optional[List[dict]]:
+        """
+        追问与上一轮 query 足够接近（且检索条件相同）时，返回上一轮的检索结果。
+        """
+        last = session.last_turn
+        if last is None or not last.results:
+            return None
+        if (last.tenant_id, last.file_filters, last.top_k) != (tenant_id, file_filters, top_k):
+            return None
+        similarity = cosine_similarity(query_vector, last.query_vector)
+        if similarity < SESSION_REUSE_THRESHOLD:
+            return None
+        print(f"   - Follow-up is close to the previous query (cos={similarity:.3f}), reusing retrieved context")
+        return last.results
+
+    def _history_messages(self, session: Session) -> list:
+        messages = []
+        for turn in list(session.turns)[-SESSION_HISTORY_TURNS:]:
+            messages.append(HumanMessage(content=turn.query))
+            messages.append(AIMessage(content=turn.answer))
+        return messages
     
-    def invoke(self, query: str, top_k: int = 6, file_filters: Optional[List[str]] = None, model: Optional[str] = None) -> tuple[str, list[dict]]:
+    def invoke(
+        self,
+        query: str,
+        top_k: int = 6,
+        file_filters: Optional[List[str]] = None,
+        model: Optional[str] = None,
+        tenant_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> tuple[str, list[dict]]:
         """
         The complete RAG process: retrieve -> format -> generate answer.
         Now accepts an optional 'model' parameter to dynamically switch LLMs.
+        With a session_id, recent turns are kept and the retrieved context is reused
+        for follow-ups that are close to the previous query.
         """
         print(f"Searching for: '{query}'")
         if file_filters:
             print(f"   - Applying file filters: {file_filters}")
-        
-        results = self.retrieve_documents(query, top_k, file_filters)
+
+        # 会话按 tenant 隔离：其它 tenant 用相同 session_id 拿不到这里的历史与检索结果
+        session = self.sessions.get_or_create(tenant_id or DEFAULT_TENANT, session_id) if session_id else None
+        query_vector = None
+        results = None
+        if session is not None:
+            query_vector = self._embed_query(query)
+            results = self._reusable_results(session, query_vector, top_k, file_filters, tenant_id)
+        if results is None:
+            results = self.retrieve_documents(query, top_k, file_filters, tenant_id, query_vector=query_vector)
         
         if not results:
             return "Based on the selected files, I can't find any relevant documentation to answer your question.", []
@@ -192,8 +311,8 @@ class QdrantRAGChain:
         if model:
             print(f"Switching to model for this request: {model}")
             try:
-                # This creates a temporary LLM instance for the current request
-                llm_to_use = ChatOllama(model=model)
+                # This creates a temporary LLM instance for the current request (served by the Ollama pool)
+                llm_to_use = pooled_chat(model)
             except Exception as e:
                 print(f"Could not initialize model '{model}'. Falling back to default. Error: {e}")
         
@@ -201,12 +320,35 @@ class QdrantRAGChain:
         
         try:
             print("Generating response...")
-            formatted_prompt = self.prompt.format(context=context, input=query)
+            if session is not None:
+                formatted_prompt = self.session_prompt.format_messages(
+                    context=context, history=self._history_messages(session), input=query
+                )
+            else:
+                formatted_prompt = self.prompt.format(context=context, input=query)
             
             # Use the determined LLM instance (either default or temporary)
-            response = llm_to_use.invoke(formatted_prompt)
+            # 同一会话固定到同一个 Ollama 节点，复用稳定前缀的 prompt cache
+            affinity = f"{tenant_id or DEFAULT_TENANT}/{session_id}" if session is not None else None
+            response = llm_to_use.invoke(formatted_prompt, affinity=affinity)
+            answer = str(response.content)
+
+            if session is not None:
+                session.add_turn(Turn(
+                    query=query,
+                    query_vector=query_vector,
+                    results=results,
+                    answer=answer,
+                    tenant_id=tenant_id,
+                    file_filters=file_filters,
+                    top_k=top_k,
+                    chunk_ids=[
+                        str(r["doc"].metadata.get("_id", r["doc"].metadata.get("parent_id")))
+                        for r in results if r.get("doc")
+                    ],
+                ))
             
-            return str(response.content), results
+            return answer, results
             
         except Exception as e:
             print(f"Error during response generation: {e}")
@@ -267,18 +409,39 @@ def initialize_rag_chain(model_name: str = "gemma3:latest") -> Optional[QdrantRA
 
     print(f" Initializing LLM: {model_name}")
     try:
-        llm = ChatOllama(model=model_name)
+        llm = pooled_chat(model_name)
     except Exception as e:
         print(f" Error initializing LLM: {e}")
         return None
 
+    # 并发 /query 的 embedding 与 Qdrant 检索合并成批（NumpyVectorStore 本身就是本地矩阵运算，无需包装）
+    if QUERY_BATCHING and isinstance(vectorstore, QdrantVectorStore):
+        vectorstore = BatchedVectorStore(
+            vectorstore,
+            max_batch_size=QUERY_BATCH_MAX_SIZE,
+            max_wait_ms=QUERY_BATCH_MAX_WAIT_MS,
+        )
+    elif QUERY_BATCHING and isinstance(vectorstore, ShardedVectorStore):
+        # 客户端分片：query embedding 合并成批，每个分片上的检索各自合并成 query_batch_points
+        vectorstore = ShardedVectorStore(
+            [
+                BatchedVectorStore(shard, max_batch_size=QUERY_BATCH_MAX_SIZE, max_wait_ms=QUERY_BATCH_MAX_WAIT_MS)
+                for shard in vectorstore.shards
+            ],
+            embeddings=MicroBatchingEmbeddings(
+                vectorstore.embeddings, max_batch_size=QUERY_BATCH_MAX_SIZE, max_wait_ms=QUERY_BATCH_MAX_WAIT_MS
+            ),
+            max_workers=QDRANT_SHARD_SEARCH_WORKERS,
+        )
+
     preferred_sources = ['Meta backend Developer.pdf']
     # file_filters = ['Meta backend Developer.pdf', 'employee_data.csv']
 
     rag_chain = QdrantRAGChain(
         vectorstore=vectorstore,
         llm=llm,
-        preferred_sources=preferred_sources if preferred_sources else None
+        preferred_sources=preferred_sources if preferred_sources else None,
+        parent_document=PARENT_DOCUMENT_RETRIEVAL,
     )
     # rag_chain.set_file_filters(file_filters)
     
@@ -312,7 +475,7 @@ def main():
             print("\n" + "-" * 50)
             
             # 使用 RAG chain 的 invoke 方法
-            answer, results = rag_chain.invoke(query)
+            answer, results = rag_chain.invoke(query, session_id="cli")
             
             # 打印检索到的文档
             print_retrieved_docs_custom(results)
@@ -0,0 +1,193 @@
+# chunker.py
+"""
+- 基于 token 的快速切分：每个文档只 tokenize 一次，直接在 token 偏移上切 chunk
+- 切点优先落在分隔符上（段落 > 换行 > 句子 > 空格），找不到时在 token 边界硬切
+- 每个进程只构建一个 tiktoken encoder（lru_cache）
+- chunk metadata 记录 token_count / char_start / char_end，后续做 prompt 预算时无需重新 tokenize
+"""
+from config import *
+from bisect import bisect_left
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import tiktoken
+from langchain_core.documents import Document
+
+DEFAULT_SEPARATORS = ("\n\n", "\n", ". ", "。", " ")
+
+
+@lru_cache(maxsize=None)
+def get_encoder(encoding_name: str = CHUNK_ENCODING) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(encoding_name)
+
+
+@lru_cache(maxsize=None)
+def token_byte_lengths(encoding_name: str = CHUNK_ENCODING) -> np.ndarray:
+    """整个词表的 token 字节长度查找表，token -> 字符偏移时不再逐个 decode。"""
+    encoder = get_encoder(encoding_name)
+    lengths = np.zeros(encoder.n_vocab, dtype=np.int64)
+    for token in range(encoder.n_vocab):
+        try:
+            lengths[token] = len(encoder.decode_single_token_bytes(token))
+        except KeyError:
+            pass  # 词表中的空洞
+    return lengths
+
+
+@dataclass
+class TextChunk:
+    text: str
+    token_count: int
+    char_start: int
+    char_end: int
+    token_start: int
+    token_end: int
+
+
+class TokenizedText:
+    """
+    文本 + 每个 token 的起始字符偏移（末尾追加 len(text) 作为哨兵）。
+    多字节字符被 BPE 拆开时，token 起点落到下一个完整字符，保证切片总是合法的 str。
+    """
+    def __init__(self, text: str, encoding_name: str = CHUNK_ENCODING):
+        self.text = text
+        tokens = np.asarray(get_encoder(encoding_name).encode_ordinary(text), dtype=np.int64)
+        self.num_tokens = len(tokens)
+        token_bytes = token_byte_lengths(encoding_name)[tokens]
+        byte_starts = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum(token_bytes, out=byte_starts[1:])
+        if not text.isascii():
+            raw = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+            # 每个字节之前有多少个字符起始字节 => 字节偏移 -> 字符偏移
+            char_at_byte = np.zeros(len(raw) + 1, dtype=np.int64)
+            np.cumsum((raw & 0xC0) != 0x80, out=char_at_byte[1:])
+            byte_starts = char_at_byte[byte_starts]
+        self.starts: List[int] = byte_starts.tolist()
+
+
+class TokenChunker:
+    """
+    chunk_size / chunk_overlap 以 token 计，语义与 RecursiveCharacterTextSplitter.from_tiktoken_encoder 一致。
+    """
+    def __init__(
+        self,
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = CHUNK_OVERLAP,
+        encoding_name: str = CHUNK_ENCODING,
+        separators: Sequence[str] = DEFAULT_SEPARATORS,
+    ):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.encoding_name = encoding_name
+        self.separators = list(separators)
+        # 切点至少落在窗口后半段，避免因为靠前的分隔符产生过小的 chunk
+        self.min_tokens = max(1, chunk_size // 2)
+
+    def tokenize(self, text: str) -> TokenizedText:
+        return TokenizedText(text, self.encoding_name)
+
+    # ----------------- 切分 -----------------
+    def _cut(self, tok: TokenizedText, start: int, limit: int) -> int:
+        """在 (start + min_tokens, limit] 内找最靠后的分隔符切点，返回切点 token 下标。"""
+        starts, text = tok.starts, tok.text
+        lo_char = starts[min(start + self.min_tokens, limit)]
+        hi_char = starts[limit]
+        for sep in self.separators:
+            pos = text.rfind(sep, lo_char, hi_char)
+            if pos < 0:
+                continue
+            cut = bisect_left(starts, pos + len(sep), start + 1, limit + 1)
+            if cut <= limit:
+                return cut
+        return limit
+
+    def _overlap_start(self, tok: TokenizedText, start: int, end: int) -> int:
+        """下一个 chunk 的起点：回退 chunk_overlap 个 token，并对齐到词边界。"""
+        if self.chunk_overlap <= 0:
+            return end
+        begin = max(end - self.chunk_overlap, start + 1)
+        starts, text = tok.starts, tok.text
+        for sep in (" ", "\n"):
+            pos = text.find(sep, starts[begin], starts[end])
+            if pos >= 0:
+                return max(bisect_left(starts, pos, begin, end), begin)
+        return begin
+
+    def split_spans(
+        self, tok: TokenizedText, token_start: int = 0, token_end: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        """把 token 区间 [token_start, token_end) 切成若干 (start, end) token 区间。"""
+        token_end = tok.num_tokens if token_end is None else token_end
+        spans: List[Tuple[int, int]] = []
+        start = token_start
+        while start < token_end:
+            limit = min(start + self.chunk_size, token_end)
+            end = token_end if limit == token_end else self._cut(tok, start, limit)
+            spans.append((start, end))
+            if end >= token_end:
+                break
+            start = self._overlap_start(tok, start, end)
+        return spans
+
+    def make_chunk(self, tok: TokenizedText, start: int, end: int) -> Optional[TextChunk]:
+        char_start, char_end = tok.starts[start], tok.starts[end]
+        raw = tok.text[char_start:char_end]
+        text = raw.strip()
+        if not text:
+            return None
+        char_start += len(raw) - len(raw.lstrip())
+        return TextChunk(text, end - start, char_start, char_start + len(text), start, end)
+
+    def split_tokenized(
+        self, tok: TokenizedText, token_start: int = 0, token_end: Optional[int] = None
+    ) -> List[TextChunk]:
+        chunks = []
+        for start, end in self.split_spans(tok, token_start, token_end):
+            chunk = self.make_chunk(tok, start, end)
+            if chunk is not None:
+                chunks.append(chunk)
+        return chunks
+
+    def split_text(self, text: str) -> List[TextChunk]:
+        return self.split_tokenized(self.tokenize(text))
+
+    def split_documents(self, docs: List[Document]) -> List[Document]:
+        out = []
+        for doc in docs:
+            for chunk in self.split_text(doc.page_content):
+                out.append(chunk_document(chunk, doc.metadata))
+        return out
+
+
+def chunk_document(chunk: TextChunk, metadata: dict) -> Document:
+    meta = dict(metadata or {})
+    meta.update({"token_count": chunk.token_count, "char_start": chunk.char_start, "char_end": chunk.char_end})
+    return Document(page_content=chunk.text, metadata=meta)
+
+
+def split_parent_child(
+    docs: List[Document], parent_chunker: TokenChunker, child_chunker: TokenChunker
+) -> List[Tuple[Document, List[Document]]]:
+    """
+    父段落与子 chunk 共用同一次 tokenize：子 chunk 直接在父段落的 token 区间内切分。
+    返回 [(父段落, [子 chunk...]), ...]，字符偏移都相对于原文档。
+    """
+    if parent_chunker.encoding_name != child_chunker.encoding_name:
+        raise ValueError("parent and child chunkers must share an encoding")
+    pairs = []
+    for doc in docs:
+        tok = parent_chunker.tokenize(doc.page_content)
+        for p_start, p_end in parent_chunker.split_spans(tok):
+            parent_chunk = parent_chunker.make_chunk(tok, p_start, p_end)
+            if parent_chunk is None:
+                continue
+            children = [
+                chunk_document(child, doc.metadata)
+                for child in child_chunker.split_tokenized(tok, p_start, p_end)
+            ]
+            pairs.append((chunk_document(parent_chunk, doc.metadata), children))
+    return pairs
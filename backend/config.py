@@ -1,8 +1,81 @@
 # Configuration settings for the backend application
+import os
+
 QDRANT_URL = "http://localhost:6333"
 QDRANT_PATH = "/tmp/langchain_qdrant"
 QDRANT_COLLECTION = "knowledge_base"
 EMBEDDING_MODEL_NAME = "nomic-embed-text:latest"
 
 CHUNK_SIZE = 512
-CHUNK_OVERLAP = 102
\ No newline at end of file
+CHUNK_OVERLAP = 102
+# chunk 大小按该 tiktoken encoding 计算 token 数（与 from_tiktoken_encoder 默认一致）
+CHUNK_ENCODING = "gpt2"
+
+# Parent-document (small-to-big) retrieval:
+# 小 chunk 用于 embedding 检索，命中后展开为所属的父段落交给 LLM
+PARENT_DOCUMENT_RETRIEVAL = False
+PARENT_CHUNK_SIZE = 2048
+PARENT_CHUNK_OVERLAP = 0
+CHILD_CHUNK_SIZE = 256
+CHILD_CHUNK_OVERLAP = 32
+
+# Multi-tenant: 所有 tenant 共用一个 collection，按 payload 中的 tenant_id 分区
+DEFAULT_TENANT = "default"
+TENANT_PAYLOAD_KEY = "tenant_id"
+# 查询总是带 tenant filter，因此关闭全局 HNSW 图（m=0），只为每个 tenant 建图
+TENANT_HNSW_PAYLOAD_M = 16
+
+# Query-side micro-batching：并发查询的 embedding 与检索合并成批
+QUERY_BATCHING = True
+QUERY_BATCH_MAX_SIZE = 32
+QUERY_BATCH_MAX_WAIT_MS = 5
+QUERY_BATCH_TIMEOUT_S = 30  # 等待所在批次结果的上限，worker 卡住时调用方超时而不是一直挂起
+
+# Ingest checkpoint：每提交一批 chunk 写一次 manifest，中断后从最后提交的批次继续
+INGEST_BATCH_SIZE = 64
+
+# 会话记忆：追问与上一轮 query 足够接近时复用已检索的上下文
+SESSION_MAX_SESSIONS = 1000
+SESSION_MAX_TURNS = 8
+SESSION_TTL_SECONDS = 1800
+SESSION_HISTORY_TURNS = 4
+SESSION_REUSE_THRESHOLD = 0.85
+# 让 Ollama 保持模型常驻，配合稳定的 prompt 前缀复用 KV/prompt cache
+OLLAMA_KEEP_ALIVE = "30m"
+
+# memory / disk 模式的本地向量后端："qdrant"（QdrantClient 本地模式）或 "numpy"（mmap 精确检索）
+LOCAL_VECTOR_BACKEND = "qdrant"
+NUMPY_STORE_PATH = "/tmp/langchain_numpy_store"
+NUMPY_STORE_DTYPE = "float32"  # "float16" 可减半内存/磁盘占用
+
+# LLM 生成准入控制：每个模型的并发上限与等待队列
+# 并发按 endpoint 计（建议与各节点的 OLLAMA_NUM_PARALLEL 一致），总并发 = GENERATION_MAX_CONCURRENCY * len(OLLAMA_ENDPOINTS)
+GENERATION_MAX_CONCURRENCY = 2
+GENERATION_MAX_QUEUE = 32
+GENERATION_MAX_BATCH_QUEUE = 16
+GENERATION_INTERACTIVE_RESERVED = 1  # 并发 > 1 时为 interactive 预留的槽位数
+GENERATION_DEFAULT_DEADLINE_MS = 60000
+
+# 按需 profiling（/debug/* 端点与 /query 的 profile 参数），默认关闭；生产环境可用 RAG_PROFILING=1 临时开启
+PROFILING_ENABLED = os.environ.get("RAG_PROFILING", "0") == "1"
+PROFILING_MAX_SAMPLE_SECONDS = 60
+
+# Ollama endpoint 池：embedding 与生成按最少在途请求分发到多台 Ollama，带健康检查与熔断
+# 逗号分隔，如 RAG_OLLAMA_ENDPOINTS="http://gpu1:11434,http://gpu2:11434"；默认沿用 OLLAMA_HOST / 本机
+OLLAMA_ENDPOINTS = os.environ.get(
+    "RAG_OLLAMA_ENDPOINTS", os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+).split(",")
+OLLAMA_EMBED_SUB_BATCH = 16  # 一批 embedding 拆成多个子批并行发往不同节点
+OLLAMA_CIRCUIT_FAILURES = 3
+OLLAMA_CIRCUIT_RESET_SECONDS = 30
+OLLAMA_HEALTH_INTERVAL_SECONDS = 10
+OLLAMA_MAX_RETRIES = 2
+
+# Qdrant 集群：创建 collection 时的分片数 / 副本数 / 写一致性（None = 服务端默认，仅 server 模式生效）
+QDRANT_SHARD_NUMBER = None
+QDRANT_REPLICATION_FACTOR = None
+QDRANT_WRITE_CONSISTENCY_FACTOR = None
+# 多个独立 Qdrant 实例（非集群）：客户端按 source 分片写入，查询并行发往所有实例后按分数合并
+# 逗号分隔，如 RAG_QDRANT_SHARD_URLS="http://qdrant-a:6333,http://qdrant-b:6333"；为空时使用 QDRANT_URL
+QDRANT_SHARD_URLS = [u for u in os.environ.get("RAG_QDRANT_SHARD_URLS", "").split(",") if u.strip()]
+QDRANT_SHARD_SEARCH_WORKERS = 8
@@ -0,0 +1,65 @@
+# docstore.py
+"""
+- 本地 parent docstore，用于 parent-document / small-to-big retrieval
+- 父段落按 ID 存成单独的 JSON 文件，子 chunk 的 payload 里只保存 parent_id
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.stores import BaseStore
+
+
+class LocalDocStore(BaseStore[str, Document]):
+    """
+    基于文件系统的 key -> Document 存储（每个 key 一个 JSON 文件）。
+    """
+    def __init__(self, root_path: str | Path):
+        self.root_path = Path(root_path)
+        self.root_path.mkdir(parents=True, exist_ok=True)
+
+    def _path_for(self, key: str) -> Path:
+        if not key or "/" in key or "\\" in key or ".." in key:
+            raise ValueError(f"Invalid docstore key: {key!r}")
+        return self.root_path / f"{key}.json"
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[Document]]:
+        docs: List[Optional[Document]] = []
+        for key in keys:
+            path = self._path_for(key)
+            if not path.exists():
+                docs.append(None)
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            docs.append(Document(page_content=data["page_content"], metadata=data.get("metadata", {})))
+        return docs
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, Document]]) -> None:
+        for key, doc in key_value_pairs:
+            path = self._path_for(key)
+            tmp_path = path.with_suffix(".json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"page_content": doc.page_content, "metadata": doc.metadata}, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, path)
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        for key in keys:
+            path = self._path_for(key)
+            if path.exists():
+                path.unlink()
+
+    def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
+        for path in self.root_path.glob("*.json"):
+            key = path.stem
+            if prefix is None or key.startswith(prefix):
+                yield key
+
+    def clear(self) -> None:
+        """删除所有父文档（recreate 时使用）。"""
+        if self.root_path.exists():
+            shutil.rmtree(self.root_path)
+        self.root_path.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,63 @@
+# manifest.py
+"""
+- 每个 tenant 一份 ingest manifest（JSON），记录已入库的文件与 chunk 数
+- 写入采用临时文件 + os.replace，保证进程中途退出时不会留下半截文件
+"""
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+SCRIPT_DIR = Path(__file__).parent
+MANIFEST_DIR = SCRIPT_DIR / "manifests"
+
+
+def manifest_path(tenant_id: str) -> Path:
+    return MANIFEST_DIR / f"{tenant_id}.json"
+
+
+def load_manifest(tenant_id: str) -> Dict[str, Any]:
+    """读取 tenant 的 manifest；不存在时返回空 manifest。"""
+    path = manifest_path(tenant_id)
+    if path.exists():
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: failed to read manifest {path}: {e}")
+    return {"tenant_id": tenant_id, "files": {}}
+
+
+def save_manifest(tenant_id: str, manifest: Dict[str, Any]) -> None:
+    MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+    manifest["tenant_id"] = tenant_id
+    manifest["updated_at"] = time.time()
+    path = manifest_path(tenant_id)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def delete_manifest(tenant_id: str) -> None:
+    path = manifest_path(tenant_id)
+    if path.exists():
+        path.unlink()
+
+
+def list_manifests() -> List[Dict[str, Any]]:
+    """所有 tenant 的 manifest 摘要。"""
+    if not MANIFEST_DIR.exists():
+        return []
+    summaries = []
+    for path in sorted(MANIFEST_DIR.glob("*.json")):
+        manifest = load_manifest(path.stem)
+        files = manifest.get("files", {})
+        summaries.append({
+            "tenant_id": path.stem,
+            "files": len(files),
+            "chunks": sum(f.get("chunks", 0) for f in files.values()),
+            "updated_at": manifest.get("updated_at"),
+        })
+    return summaries
@@ -0,0 +1,407 @@
+# numpy_store.py
+"""
+- 本地精确检索后端（memory / disk 模式可选），替代 QdrantClient 本地模式的纯 Python 暴力检索
+- 向量归一化后存成连续矩阵（disk 模式为 np.memmap），支持 float32 / float16
+- 常用过滤字段（tenant_id / source / is_structured）按列存成整数编码，过滤为向量化 mask
+- 完整 payload 存在 JSONL sidecar + offset 索引，只在返回 top-k 时读取
+- 支持追加写入与 tombstone 删除；检索接口与 QdrantVectorStore.similarity_search_with_score 相同
+"""
+from config import TENANT_PAYLOAD_KEY
+import json
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from qdrant_client.http import models as qmodels
+
+METADATA_PREFIX = "metadata."
+DEFAULT_COLUMNS = (TENANT_PAYLOAD_KEY, "source", "is_structured")
+_INITIAL_CAPACITY = 1024
+
+
+class NumpyVectorStore:
+    """
+    path 为 None 时所有数据只在内存中；否则存放在 path 目录下：
+      meta.json         维度 / dtype / 行数 / 容量 / 各列的取值字典
+      vectors.bin       (capacity, dim) 归一化向量
+      tombstones.bin    (capacity,) uint8，1 表示已删除
+      col_<name>.bin    (capacity,) int32 取值编码，-1 表示缺失
+      offsets.bin       (capacity,) int64，payloads.jsonl 中每行的起始字节
+      payloads.jsonl    每行 {"id", "page_content", "metadata"}
+      ids.txt           每行一个 point ID（与行号对应，打开时用于重建 ID 索引）
+    """
+    def __init__(
+        self,
+        embedding: Embeddings,
+        dim: int,
+        path: Optional[str | Path] = None,
+        dtype: str = "float32",
+        columns: Sequence[str] = DEFAULT_COLUMNS,
+        block_size: int = 16384,
+    ):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        self.embeddings = embedding
+        self.dim = dim
+        self.path = Path(path) if path is not None else None
+        self.dtype = np.dtype(dtype)
+        self.columns = list(columns)
+        self.block_size = block_size
+        self.count = 0
+        self.capacity = 0
+        self._column_values: Dict[str, List[Any]] = {c: [] for c in self.columns}
+        self._column_codes: Dict[str, Dict[Any, int]] = {c: {} for c in self.columns}
+        self._id_to_row: Dict[str, int] = {}
+        self._payloads: List[str] = []  # 仅内存模式使用
+        self._lock = threading.RLock()
+
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            if (self.path / "meta.json").exists():
+                self._load()
+                return
+        self._allocate(_INITIAL_CAPACITY)
+        self._save_meta()
+
+    # ----------------- 打开 / 持久化 -----------------
+    @classmethod
+    def open(
+        cls,
+        embedding: Embeddings,
+        dim: int,
+        path: Optional[str | Path] = None,
+        dtype: str = "float32",
+        **kwargs: Any,
+    ) -> Tuple["NumpyVectorStore", bool]:
+        """
+        打开（或创建）store。已有数据的维度或 dtype 不一致时清空重建，第二个返回值为 True。
+        """
+        reset = False
+        if path is not None and (Path(path) / "meta.json").exists():
+            with open(Path(path) / "meta.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("dim") != dim or meta.get("dtype") != dtype:
+                cls.destroy(path)
+                reset = True
+        return cls(embedding, dim, path=path, dtype=dtype, **kwargs), reset
+
+    @staticmethod
+    def destroy(path: str | Path) -> None:
+        path = Path(path)
+        if path.exists():
+            for child in path.iterdir():
+                child.unlink()
+            path.rmdir()
+
+    def _file(self, name: str) -> Path:
+        return self.path / name
+
+    def _map(self, name: str, dtype: Any, shape: Tuple[int, ...]) -> np.ndarray:
+        file_path = self._file(name)
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(file_path, "ab") as f:
+            if f.tell() < nbytes:
+                f.truncate(nbytes)
+        return np.memmap(file_path, dtype=dtype, mode="r+", shape=shape)
+
+    def _allocate(self, capacity: int) -> None:
+        """分配（或扩容到）capacity 行；disk 模式扩展文件后重新 mmap。"""
+        if self.path is not None:
+            self._vectors = self._map("vectors.bin", self.dtype, (capacity, self.dim))
+            self._tombstones = self._map("tombstones.bin", np.uint8, (capacity,))
+            self._offsets = self._map("offsets.bin", np.int64, (capacity,))
+            self._codes = {c: self._map(f"col_{c}.bin", np.int32, (capacity,)) for c in self.columns}
+            if capacity > self.capacity:
+                for codes in self._codes.values():
+                    codes[self.capacity:] = -1
+        else:
+            def grow(old: Optional[np.ndarray], shape: Tuple[int, ...], dtype: Any, fill: Any = 0) -> np.ndarray:
+                new = np.full(shape, fill, dtype=dtype)
+                if old is not None:
+                    new[: len(old)] = old
+                return new
+            first = self.capacity == 0
+            self._vectors = grow(None if first else self._vectors, (capacity, self.dim), self.dtype)
+            self._tombstones = grow(None if first else self._tombstones, (capacity,), np.uint8)
+            self._offsets = grow(None if first else self._offsets, (capacity,), np.int64)
+            self._codes = {
+                c: grow(None if first else self._codes[c], (capacity,), np.int32, -1) for c in self.columns
+            }
+        self.capacity = capacity
+
+    def _save_meta(self) -> None:
+        if self.path is None:
+            return
+        meta = {
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "count": self.count,
+            "capacity": self.capacity,
+            "columns": self._column_values,
+        }
+        tmp_path = self._file("meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._file("meta.json"))
+
+    def _load(self) -> None:
+        with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.count = meta["count"]
+        self.columns = list(meta["columns"].keys())
+        self._column_values = {c: list(v) for c, v in meta["columns"].items()}
+        self._column_codes = {c: {v: i for i, v in enumerate(vals)} for c, vals in self._column_values.items()}
+        # 容量与 meta 相同，_allocate 只做 mmap，不会重置已有的列编码
+        self.capacity = meta["capacity"]
+        self._allocate(meta["capacity"])
+        # ids.txt / payloads.jsonl 可能比 meta 多出崩溃前未提交的行：offset 是绝对位置，多余的行不影响读取，
+        # 但 ids.txt 需要按 count 截断，保证行号对应
+        ids_path = self._file("ids.txt")
+        ids = ids_path.read_text(encoding="utf-8").split("\n")[: self.count] if ids_path.exists() else []
+        with open(ids_path, "w", encoding="utf-8") as f:
+            f.write("".join(f"{pid}\n" for pid in ids))
+        for row, point_id in enumerate(ids):
+            if not self._tombstones[row]:
+                self._id_to_row[point_id] = row
+
+    def flush(self) -> None:
+        if self.path is not None:
+            for arr in (self._vectors, self._tombstones, self._offsets, *self._codes.values()):
+                arr.flush()
+        self._save_meta()
+
+    # ----------------- 写入 -----------------
+    def _encode(self, column: str, value: Any) -> int:
+        if value is None:
+            return -1
+        codes = self._column_codes[column]
+        if value not in codes:
+            codes[value] = len(self._column_values[column])
+            self._column_values[column].append(value)
+        return codes[value]
+
+    def add_embeddings(self, ids: Sequence[str], vectors: np.ndarray, documents: Sequence[Document]) -> List[str]:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+
+        with self._lock:
+            needed = self.count + len(ids)
+            if needed > self.capacity:
+                capacity = max(self.capacity, _INITIAL_CAPACITY)
+                while capacity < needed:
+                    capacity *= 2
+                self._allocate(capacity)
+
+            # 相同 ID 重复写入（例如 ingest 断点续传）时，旧行打 tombstone
+            for point_id in ids:
+                old_row = self._id_to_row.get(str(point_id))
+                if old_row is not None:
+                    self._tombstones[old_row] = 1
+
+            start = self.count
+            rows = slice(start, start + len(ids))
+            self._vectors[rows] = vectors.astype(self.dtype)
+            self._tombstones[rows] = 0
+            for column in self.columns:
+                self._codes[column][rows] = [
+                    self._encode(column, (doc.metadata or {}).get(column)) for doc in documents
+                ]
+
+            lines = [
+                json.dumps({"id": str(pid), "page_content": doc.page_content, "metadata": doc.metadata},
+                           ensure_ascii=False, default=str)
+                for pid, doc in zip(ids, documents)
+            ]
+            if self.path is not None:
+                with open(self._file("ids.txt"), "a", encoding="utf-8") as f:
+                    f.write("".join(f"{pid}\n" for pid in ids))
+                with open(self._file("payloads.jsonl"), "ab") as f:
+                    offset = f.tell()
+                    for i, line in enumerate(lines):
+                        data = (line + "\n").encode("utf-8")
+                        self._offsets[start + i] = offset
+                        f.write(data)
+                        offset += len(data)
+            else:
+                self._offsets[rows] = np.arange(len(self._payloads), len(self._payloads) + len(ids))
+                self._payloads.extend(lines)
+
+            for i, point_id in enumerate(ids):
+                self._id_to_row[str(point_id)] = start + i
+            self.count += len(ids)
+            self.flush()
+        return [str(pid) for pid in ids]
+
+    def add_documents(self, documents: List[Document], ids: Optional[Sequence[str]] = None, **kwargs: Any) -> List[str]:
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in documents]
+        vectors = self.embeddings.embed_documents([doc.page_content for doc in documents])
+        return self.add_embeddings(list(ids), np.asarray(vectors), documents)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> bool:
+        with self._lock:
+            for point_id in ids or []:
+                row = self._id_to_row.pop(str(point_id), None)
+                if row is not None:
+                    self._tombstones[row] = 1
+            self.flush()
+        return True
+
+    def delete_by_filter(self, filter: qmodels.Filter) -> int:
+        """按 filter 打 tombstone，返回删除的行数。"""
+        with self._lock:
+            rows = np.flatnonzero(self._mask(filter, self.count))
+            if len(rows):
+                self._tombstones[rows] = 1
+                row_set = set(rows.tolist())
+                self._id_to_row = {pid: row for pid, row in self._id_to_row.items() if row not in row_set}
+            self.flush()
+        return len(rows)
+
+    # ----------------- 过滤 -----------------
+    def _condition_mask(self, condition: Any, n: int) -> np.ndarray:
+        if not isinstance(condition, qmodels.FieldCondition) or not condition.key.startswith(METADATA_PREFIX):
+            raise ValueError(f"Unsupported filter condition for numpy backend: {condition}")
+        column = condition.key[len(METADATA_PREFIX):]
+        if column not in self._codes:
+            raise ValueError(f"Field '{column}' is not an indexed column ({self.columns})")
+        match = condition.match
+        if isinstance(match, qmodels.MatchValue):
+            values = [match.value]
+        elif isinstance(match, qmodels.MatchAny):
+            values = list(match.any)
+        else:
+            raise ValueError(f"Unsupported match type for numpy backend: {match}")
+        codes = [self._column_codes[column][v] for v in values if v in self._column_codes[column]]
+        if not codes:
+            return np.zeros(n, dtype=bool)
+        return np.isin(self._codes[column][:n], codes)
+
+    def _mask(self, filter: Optional[qmodels.Filter], n: int) -> np.ndarray:
+        """未删除且满足 filter（must / must_not）的行。"""
+        mask = self._tombstones[:n] == 0
+        if filter is None:
+            return mask
+        for condition in filter.must or []:
+            mask &= self._condition_mask(condition, n)
+        for condition in filter.must_not or []:
+            mask &= ~self._condition_mask(condition, n)
+        if filter.should:
+            should = np.zeros(n, dtype=bool)
+            for condition in filter.should:
+                should |= self._condition_mask(condition, n)
+            mask &= should
+        return mask
+
+    # ----------------- 检索 -----------------
+    def _read_record(self, row: int) -> Dict[str, Any]:
+        offset = int(self._offsets[row])
+        if self.path is None:
+            return json.loads(self._payloads[offset])
+        with open(self._file("payloads.jsonl"), "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def _document(self, row: int) -> Document:
+        record = self._read_record(row)
+        metadata = dict(record.get("metadata") or {})
+        metadata["_id"] = record["id"]
+        return Document(page_content=record["page_content"], metadata=metadata)
+
+    def search_rows(self, vector: Sequence[float], k: int, filter: Optional[qmodels.Filter] = None) -> List[Tuple[int, float]]:
+        """分块矩阵-向量乘 + argpartition 的精确 top-k（cosine）。"""
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        with self._lock:
+            n = self.count
+            vectors = self._vectors
+            mask = self._mask(filter, n)
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, n, self.block_size):
+            end = min(start + self.block_size, n)
+            block_mask = mask[start:end]
+            if not block_mask.any():
+                continue
+            block = vectors[start:end]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores = block @ query
+            scores[~block_mask] = -np.inf
+            kk = min(k, end - start)
+            top = np.argpartition(-scores, kk - 1)[:kk] if kk < end - start else np.arange(end - start)
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_rows) > k:
+                keep = np.argpartition(-best_scores, k - 1)[:k]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+        order = np.argsort(-best_scores)
+        return [(int(best_rows[i]), float(best_scores[i])) for i in order if np.isfinite(best_scores[i])]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[qmodels.Filter] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return [(self._document(row), score) for row, score in self.search_rows(embedding, k, filter)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[qmodels.Filter] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embeddings.embed_query(query), k=k, filter=filter)
+
+    # ----------------- 其它 -----------------
+    def live_count(self) -> int:
+        return int((self._tombstones[: self.count] == 0).sum())
+
+    def compact(self) -> None:
+        """
+        重写为只包含未删除行的新 store（tombstone 过多时调用），disk 模式写到临时目录后整体替换。
+        """
+        with self._lock:
+            tmp_path = self.path.with_name(self.path.name + ".compact") if self.path is not None else None
+            if tmp_path is not None and tmp_path.exists():
+                shutil.rmtree(tmp_path)
+            fresh = NumpyVectorStore(
+                self.embeddings, self.dim, path=tmp_path, dtype=self.dtype.name,
+                columns=self.columns, block_size=self.block_size,
+            )
+            batch: List[Tuple[str, np.ndarray, Document]] = []
+            for record in self.iter_records():
+                batch.append(record)
+                if len(batch) >= 4096:
+                    fresh.add_embeddings([r[0] for r in batch], np.stack([r[1] for r in batch]), [r[2] for r in batch])
+                    batch = []
+            if batch:
+                fresh.add_embeddings([r[0] for r in batch], np.stack([r[1] for r in batch]), [r[2] for r in batch])
+
+            if self.path is not None:
+                del self._vectors, self._tombstones, self._offsets, self._codes
+                shutil.rmtree(self.path)
+                os.replace(tmp_path, self.path)
+                fresh = NumpyVectorStore(
+                    self.embeddings, self.dim, path=self.path, dtype=self.dtype.name, block_size=self.block_size
+                )
+            self.__dict__.update({k: v for k, v in fresh.__dict__.items() if k != "_lock"})
+
+    def iter_records(self) -> Iterator[Tuple[str, np.ndarray, Document]]:
+        """按行顺序遍历未删除的 (id, vector, document)。"""
+        for row in range(self.count):
+            if self._tombstones[row]:
+                continue
+            record = self._read_record(row)
+            yield record["id"], np.asarray(self._vectors[row], dtype=np.float32), Document(
+                page_content=record["page_content"], metadata=record.get("metadata") or {}
+            )
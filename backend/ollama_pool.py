@@ -0,0 +1,342 @@
+# ollama_pool.py
+"""
+- 多个 Ollama endpoint 组成的池，embedding 与生成都从池中选节点
+- 选择策略：最少在途请求（least outstanding），相同时选平均延迟更低的
+- 熔断：连续失败 OLLAMA_CIRCUIT_FAILURES 次后 open，OLLAMA_CIRCUIT_RESET_SECONDS 后放行一个试探请求（half-open）
+- 后台线程定期 GET /api/tags 做健康检查，恢复的节点重新加入
+- embedding 是幂等的：一批 texts 拆成子批并行发到不同节点，失败的子批换一个节点重试
+- 生成只在请求没有到达模型时（连接失败、节点上没有该模型 404）换节点重试
+- 会话亲和：同一 affinity key（tenant/session）按 rendezvous hash 固定到一个可用节点，复用该节点上的 prompt / KV cache
+"""
+from config import *
+import hashlib
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, TypeVar
+
+import httpx
+import ollama
+from ollama._client import _parse_host
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+
+T = TypeVar("T")
+
+
+class NoHealthyEndpoint(RuntimeError):
+    pass
+
+
+def normalize_url(url: str) -> str:
+    """与 ollama.Client 解析 OLLAMA_HOST 的规则一致：缺省 scheme 为 http，缺省端口为 11434（如 0.0.0.0、gpu1）。"""
+    return _parse_host(url.strip())
+
+
+def is_node_failure(error: Exception) -> bool:
+    """4xx（如模型不存在）是请求本身的问题，不计入节点熔断。"""
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code < 0 or error.status_code >= 500
+    return True
+
+
+def is_connection_failure(error: Exception) -> bool:
+    return isinstance(error, (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout))
+
+
+def is_model_missing(error: Exception) -> bool:
+    """节点上没有该模型（只装在部分节点上时），换一个节点即可。"""
+    return isinstance(error, ollama.ResponseError) and error.status_code == 404
+
+
+def is_retryable(error: Exception) -> bool:
+    """幂等请求（embedding）：节点故障或模型缺失都换节点重试。"""
+    return is_node_failure(error) or is_model_missing(error)
+
+
+def is_not_started(error: Exception) -> bool:
+    """非幂等请求（生成）：只有确定请求没有到达模型时才换节点重试。"""
+    return is_connection_failure(error) or is_model_missing(error)
+
+
+class OllamaEndpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.state = "closed"  # closed / open / half_open
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.latency_ewma = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_failures": self.consecutive_failures,
+            "latency_ms": round(self.latency_ewma * 1000, 1),
+            "last_error": self.last_error,
+        }
+
+
+class OllamaPool:
+    def __init__(
+        self,
+        urls: Sequence[str],
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        health_interval: float = 10.0,
+        max_retries: int = 2,
+    ):
+        if not urls:
+            raise ValueError("OllamaPool needs at least one endpoint")
+        self.endpoints = [OllamaEndpoint(normalize_url(u)) for u in urls]
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.health_interval = health_interval
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._rr = itertools.count()
+        self._health_thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._known_models: Set[str] = set()
+        self._known_models_at = 0.0
+
+    # ----------------- 选择 / 释放 -----------------
+    def _available(self, ep: OllamaEndpoint, now: float) -> bool:
+        if ep.state == "closed":
+            return True
+        # open 超过 reset_timeout 后只放行一个试探请求
+        return ep.state == "open" and now - ep.opened_at >= self.reset_timeout
+
+    def acquire(self, exclude: Sequence[OllamaEndpoint] = (), affinity: Optional[str] = None) -> OllamaEndpoint:
+        with self._lock:
+            now = time.monotonic()
+            candidates = [ep for ep in self.endpoints if ep not in exclude and self._available(ep, now)]
+            if not candidates:
+                raise NoHealthyEndpoint(
+                    f"No healthy Ollama endpoint among {[ep.url for ep in self.endpoints]}"
+                )
+            if affinity is not None:
+                # rendezvous hash：节点增减时只有落在该节点上的 key 会迁移
+                ep = max(candidates, key=lambda e: hashlib.md5(f"{affinity}|{e.url}".encode("utf-8")).digest())
+            else:
+                offset = next(self._rr)
+                n = len(candidates)
+                ep = min(
+                    (candidates[(offset + i) % n] for i in range(n)),
+                    key=lambda e: (e.outstanding, e.latency_ewma),
+                )
+            if ep.state == "open":
+                ep.state = "half_open"
+            ep.outstanding += 1
+            ep.requests += 1
+            return ep
+
+    def release(self, ep: OllamaEndpoint, elapsed: float, error: Optional[Exception] = None) -> None:
+        with self._lock:
+            ep.outstanding -= 1
+            if error is None:
+                ep.latency_ewma = elapsed if ep.latency_ewma == 0 else 0.8 * ep.latency_ewma + 0.2 * elapsed
+                self._mark_healthy(ep)
+            elif is_node_failure(error):
+                self._mark_failed(ep, error)
+            else:
+                # 4xx 说明节点可达（请求本身有问题），half-open 的试探也算成功
+                self._mark_healthy(ep)
+
+    def _mark_healthy(self, ep: OllamaEndpoint) -> None:
+        if ep.state != "closed":
+            print(f"Ollama endpoint {ep.url} recovered, closing circuit.")
+        ep.state = "closed"
+        ep.consecutive_failures = 0
+
+    def _mark_failed(self, ep: OllamaEndpoint, error: Exception) -> None:
+        ep.errors += 1
+        ep.consecutive_failures += 1
+        ep.last_error = f"{type(error).__name__}: {error}"
+        if ep.state == "half_open" or ep.consecutive_failures >= self.failure_threshold:
+            if ep.state != "open":
+                print(f"Ollama endpoint {ep.url} failing ({ep.last_error}), opening circuit.")
+            ep.state = "open"
+            ep.opened_at = time.monotonic()
+
+    @contextmanager
+    def lease(self, exclude: Sequence[OllamaEndpoint] = (), affinity: Optional[str] = None) -> Iterator[OllamaEndpoint]:
+        ep = self.acquire(exclude, affinity)
+        started = time.monotonic()
+        try:
+            yield ep
+        except Exception as e:
+            self.release(ep, time.monotonic() - started, e)
+            raise
+        self.release(ep, time.monotonic() - started)
+
+    def call(
+        self,
+        fn: Callable[[OllamaEndpoint], T],
+        retry_on: Callable[[Exception], bool] = is_retryable,
+        affinity: Optional[str] = None,
+    ) -> T:
+        """在选中的节点上执行 fn(endpoint)，retry_on(error) 为真时换一个节点重试（亲和节点失败时同样换节点）。"""
+        self.start_health_checks()
+        tried: List[OllamaEndpoint] = []
+        while True:
+            try:
+                with self.lease(exclude=tried, affinity=affinity) as ep:
+                    tried.append(ep)
+                    return fn(ep)
+            except NoHealthyEndpoint:
+                raise
+            except Exception as e:
+                if len(tried) > self.max_retries or len(tried) >= len(self.endpoints) or not retry_on(e):
+                    raise
+                print(f"Ollama request on {tried[-1].url} failed ({e}), retrying on another endpoint...")
+
+    # ----------------- 健康检查 / 模型列表 -----------------
+    def _fetch_tags(self, ep: OllamaEndpoint) -> Optional[List[str]]:
+        """GET /api/tags，返回节点上已安装的模型并据此更新熔断状态；请求失败时返回 None。"""
+        try:
+            response = httpx.get(f"{ep.url}/api/tags", timeout=2.0)
+            response.raise_for_status()
+            models = [m.get("model") or m.get("name") for m in response.json().get("models", [])]
+        except Exception as e:
+            with self._lock:
+                self._mark_failed(ep, e)
+            return None
+        with self._lock:
+            self._mark_healthy(ep)
+        return models
+
+    def check_health(self) -> None:
+        for ep in self.endpoints:
+            self._fetch_tags(ep)
+
+    def list_models(self) -> Dict[str, List[str]]:
+        """熔断未打开的节点上已安装的模型，{url: [model, ...]}；请求失败的节点不在结果中。"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [ep for ep in self.endpoints if self._available(ep, now)]
+        found = {}
+        for ep in candidates:
+            models = self._fetch_tags(ep)
+            if models is not None:
+                found[ep.url] = models
+        if found:
+            self._known_models = set().union(*found.values())
+            self._known_models_at = time.monotonic()
+        return found
+
+    def known_models(self, max_age: float = 30.0) -> Set[str]:
+        """所有可用节点上已安装模型的并集，缓存 max_age 秒（用于校验请求里的模型名）。"""
+        if time.monotonic() - self._known_models_at > max_age:
+            self.list_models()
+        return self._known_models
+
+    def start_health_checks(self) -> None:
+        if self._health_thread is not None or self.health_interval <= 0:
+            return
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+                self._health_thread.start()
+
+    def _health_loop(self) -> None:
+        while not self._stopped.wait(self.health_interval):
+            self.check_health()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [ep.snapshot() for ep in self.endpoints]
+
+
+# ----------------- LangChain 适配 -----------------
+class PooledOllamaEmbeddings(Embeddings):
+    """
+    embed_documents 按 sub_batch_size 拆分后并行发往池中节点，吞吐随节点数近似线性增长。
+    """
+    def __init__(self, pool: OllamaPool, model: str = EMBEDDING_MODEL_NAME, sub_batch_size: int = 16, **kwargs: Any):
+        self.pool = pool
+        self.model = model
+        self.sub_batch_size = max(1, sub_batch_size)
+        self._kwargs = kwargs
+        self._clients: Dict[str, OllamaEmbeddings] = {}
+        self._executor = ThreadPoolExecutor(max_workers=2 * len(pool.endpoints), thread_name_prefix="ollama-embed")
+
+    def _client(self, ep: OllamaEndpoint) -> OllamaEmbeddings:
+        client = self._clients.get(ep.url)
+        if client is None:
+            client = self._clients.setdefault(ep.url, OllamaEmbeddings(model=self.model, base_url=ep.url, **self._kwargs))
+        return client
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return self.pool.call(lambda ep: self._client(ep).embed_documents(texts))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [texts[i:i + self.sub_batch_size] for i in range(0, len(texts), self.sub_batch_size)]
+        if len(batches) <= 1:
+            return self._embed_batch(texts) if texts else []
+        vectors: List[List[float]] = []
+        for result in self._executor.map(self._embed_batch, batches):
+            vectors.extend(result)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.pool.call(lambda ep: self._client(ep).embed_query(text))
+
+
+class PooledChatOllama:
+    """
+    与 ChatOllama 相同的 invoke 接口；每次调用选一个节点，只在请求没有到达模型时换节点重试（生成不是幂等的）。
+    传入 affinity（如 "tenant/session_id"）时同一会话固定到同一节点，复用 prompt 前缀的 KV cache。
+    """
+    def __init__(self, pool: OllamaPool, model: str, **kwargs: Any):
+        self.pool = pool
+        self.model = model
+        self._kwargs = kwargs
+        self._clients: Dict[str, ChatOllama] = {}
+
+    def _client(self, ep: OllamaEndpoint) -> ChatOllama:
+        client = self._clients.get(ep.url)
+        if client is None:
+            client = self._clients.setdefault(ep.url, ChatOllama(model=self.model, base_url=ep.url, **self._kwargs))
+        return client
+
+    def invoke(self, input: Any, affinity: Optional[str] = None, **kwargs: Any) -> Any:
+        return self.pool.call(
+            lambda ep: self._client(ep).invoke(input, **kwargs), retry_on=is_not_started, affinity=affinity
+        )
+
+
+@lru_cache(maxsize=None)
+def get_pool() -> OllamaPool:
+    """进程内共享的 endpoint 池（按 config.OLLAMA_ENDPOINTS 构建）。"""
+    return OllamaPool(
+        OLLAMA_ENDPOINTS,
+        failure_threshold=OLLAMA_CIRCUIT_FAILURES,
+        reset_timeout=OLLAMA_CIRCUIT_RESET_SECONDS,
+        health_interval=OLLAMA_HEALTH_INTERVAL_SECONDS,
+        max_retries=OLLAMA_MAX_RETRIES,
+    )
+
+
+# 按模型缓存：每个节点的 HTTP client（创建 SSL context 较慢）和线程池在进程内复用
+@lru_cache(maxsize=None)
+def pooled_embeddings(model: str = EMBEDDING_MODEL_NAME) -> PooledOllamaEmbeddings:
+    return PooledOllamaEmbeddings(get_pool(), model, sub_batch_size=OLLAMA_EMBED_SUB_BATCH)
+
+
+@lru_cache(maxsize=32)  # 有上限：模型名来自请求（server 已先按 known_models 校验）
+def pooled_chat(model: str) -> PooledChatOllama:
+    return PooledChatOllama(get_pool(), model, keep_alive=OLLAMA_KEEP_ALIVE)
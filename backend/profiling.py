@@ -0,0 +1,195 @@
+# profiling.py
+"""
+- 线上按需 profiling，默认关闭（config.PROFILING_ENABLED / 环境变量 RAG_PROFILING=1）
+- profile_call：只对执行该调用的线程做统计采样，返回按累计耗时排序的函数列表和 collapsed stacks
+- StackSampler：限时的统计采样（sys._current_frames），输出 collapsed stacks，可直接喂给 flamegraph.pl / speedscope
+- AllocationTracker：tracemalloc 开始 / 快照 / 停止，快照与开始时的基线做差，定位 ingest 期间的分配热点
+未开启时这些代码都不会被调用，没有额外开销。
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 线程阻塞等待时的叶子函数，默认不计入采样结果
+IDLE_FUNCTIONS = {"wait", "select", "poll", "_wait_for_tstate_lock", "accept"}
+
+
+def _function_label(filename: str, lineno: int, name: str) -> str:
+    return f"{os.path.basename(filename)}:{lineno}({name})" if lineno else name
+
+
+def _stack_of(frame: Any) -> Tuple[str, ...]:
+    """调用栈（根 -> 叶），每一帧标为 "file.py:函数首行(函数名)"。"""
+    labels: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        labels.append(_function_label(code.co_filename, code.co_firstlineno, code.co_name))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+
+def profile_call(
+    fn: Callable[..., Any], /, *args: Any, interval_ms: float = 1.0, limit: int = 30, **kwargs: Any
+) -> Tuple[Any, Dict[str, Any]]:
+    """
+    在当前线程中执行 fn(*args, **kwargs)，同时由一个采样线程每 interval_ms 读取 *当前线程* 的调用栈，返回 (结果, 报告)。
+    不用 cProfile：3.12 起它基于 sys.monitoring，会记录所有线程（并发请求、micro-batcher、健康检查），
+    而按线程 ID 采样只统计这次请求本身。
+    请求交给其它线程的工作（micro-batching、Ollama 池的子批）表现为本线程在等待的那一帧：
+    耗时算在请求上，但不展开那些线程内部的调用栈。采样精度约为 interval_ms（受 GIL 切换间隔影响）。
+    """
+    target = threading.get_ident()
+    interval = max(interval_ms, 0.1) / 1000.0
+    stacks: Counter = Counter()
+    stopped = threading.Event()
+
+    def sample() -> None:
+        while not stopped.wait(interval):
+            frame = sys._current_frames().get(target)
+            if frame is not None:
+                stacks[_stack_of(frame)] += 1
+
+    sampler = threading.Thread(target=sample, name="profile-call-sampler", daemon=True)
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        stopped.set()
+        sampler.join()
+    wall = time.perf_counter() - started
+
+    # self：该函数在栈顶；total：该函数出现在栈上（递归时同一个栈只算一次）
+    self_samples: Counter = Counter()
+    total_samples: Counter = Counter()
+    for stack, count in stacks.items():
+        self_samples[stack[-1]] += count
+        for label in set(stack):
+            total_samples[label] += count
+    samples = sum(stacks.values())
+    ms_per_sample = wall * 1000 / samples if samples else 0.0
+    return result, {
+        "wall_ms": round(wall * 1000, 2),
+        "samples": samples,
+        "interval_ms": interval_ms,
+        "functions": [
+            {
+                "function": label,
+                "self_samples": self_samples[label],
+                "total_samples": count,
+                "self_ms": round(self_samples[label] * ms_per_sample, 2),
+                "total_ms": round(count * ms_per_sample, 2),
+            }
+            for label, count in total_samples.most_common(limit)
+        ],
+        "collapsed": collapsed_stacks(Counter({";".join(stack): count for stack, count in stacks.items()})),
+    }
+
+
+class StackSampler:
+    """
+    每 interval_ms 采一次所有线程的 Python 调用栈，同一时刻只允许一个采样任务。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def sample(self, seconds: float, interval_ms: float = 5.0, include_idle: bool = False) -> Tuple[Counter, int]:
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A sampling session is already running.")
+        try:
+            return self._sample(seconds, interval_ms / 1000.0, include_idle)
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _sample(seconds: float, interval: float, include_idle: bool) -> Tuple[Counter, int]:
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        rounds = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                if not include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                parts: List[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                parts.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(parts))] += 1
+            rounds += 1
+            time.sleep(interval)
+        return stacks, rounds
+
+
+def collapsed_stacks(stacks: Counter) -> str:
+    """flamegraph.pl 的 collapsed 格式：每行 "frame;frame;frame count"。"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class AllocationTracker:
+    """tracemalloc 的开始 / 快照 / 停止，快照与 start() 时的基线比较。"""
+    def __init__(self):
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 25) -> None:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._baseline = self._take()
+
+    def stop(self) -> None:
+        with self._lock:
+            tracemalloc.stop()
+            self._baseline = None
+
+    @staticmethod
+    def _take() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    def snapshot(self, limit: int = 25, group_by: str = "lineno") -> Dict[str, Any]:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc is not running; call start first.")
+            snapshot = self._take()
+            current, peak = tracemalloc.get_traced_memory()
+            if self._baseline is not None:
+                stats = snapshot.compare_to(self._baseline, group_by)
+            else:
+                stats = snapshot.statistics(group_by)
+        top = []
+        for stat in stats[:limit]:
+            frame = stat.traceback[0]
+            entry = {
+                "location": f"{frame.filename}:{frame.lineno}",
+                "size_kb": round(stat.size / 1024, 1),
+                "count": stat.count,
+            }
+            if hasattr(stat, "size_diff"):
+                entry["size_diff_kb"] = round(stat.size_diff / 1024, 1)
+                entry["count_diff"] = stat.count_diff
+            top.append(entry)
+        return {
+            "traced_current_mb": round(current / 1024 / 1024, 2),
+            "traced_peak_mb": round(peak / 1024 / 1024, 2),
+            "group_by": group_by,
+            "top": top,
+        }
@@ -0,0 +1,252 @@
+# scheduler.py
+"""
+- LLM 生成的准入控制：每个模型一条 lane，限制并发数 + 有界等待队列
+- 优先级：interactive 总是先于 batch 出队；并发 > 1 时为 interactive 预留槽位，
+  队列满时 interactive 可以挤掉排队中的 batch 请求，由 batch 调用方承担背压
+- deadline：排队期间过期直接丢弃（504）；预计等待时间已超过 deadline 时入队前就拒绝
+- 拒绝时抛 SchedulerRejected（带 Retry-After 秒数），由 server 转成 429 / 503 / 504
+- lane 数量有上限（max_lanes）：超出时回收空闲 lane，都在忙时拒绝新模型
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class SchedulerRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    deadline: float = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class _Lane:
+    """单个模型的调度状态，只在 event loop 线程中访问，不需要加锁。"""
+    def __init__(self, model: str, max_concurrency: int, max_queue: int, max_batch_queue: int, reserved: int):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_batch_queue = max_batch_queue
+        self.reserved = reserved if max_concurrency > 1 else 0
+        self.running = 0
+        self.heap: List[_Waiter] = []
+        self.queued = {name: 0 for name in PRIORITIES}
+        self.service_ewma = 5.0  # 秒，生成耗时的指数滑动平均，用于估算等待时间
+        self.waits: Dict[str, Deque[float]] = {name: deque(maxlen=512) for name in PRIORITIES}
+        self.counters = {"admitted": 0, "completed": 0, "failed": 0, "rejected": 0, "expired": 0, "evicted": 0}
+
+    def slot_limit(self, priority: int) -> int:
+        return self.max_concurrency if priority == PRIORITIES["interactive"] else self.max_concurrency - self.reserved
+
+    def estimated_wait(self, ahead: int) -> float:
+        return (ahead // self.max_concurrency + (1 if self.running >= self.max_concurrency else 0)) * self.service_ewma
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.estimated_wait(len(self.heap))))
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class GenerationScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = 2,
+        max_queue: int = 32,
+        max_batch_queue: int = 16,
+        interactive_reserved: int = 1,
+        default_deadline_ms: int = 60000,
+        max_lanes: int = 16,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_batch_queue = max_batch_queue
+        self.interactive_reserved = interactive_reserved
+        self.default_deadline_ms = default_deadline_ms
+        self.max_lanes = max_lanes
+        self._lanes: Dict[str, _Lane] = {}
+        self._seq = itertools.count()
+
+    def _lane(self, model: str) -> _Lane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            if len(self._lanes) >= self.max_lanes:
+                idle = [name for name, l in self._lanes.items() if l.running == 0 and not l.heap]
+                if not idle:
+                    raise SchedulerRejected(503, f"Too many models in use (max {self.max_lanes}).", 5)
+                for name in idle:
+                    del self._lanes[name]
+            lane = _Lane(model, self.max_concurrency, self.max_queue, self.max_batch_queue, self.interactive_reserved)
+            self._lanes[model] = lane
+        return lane
+
+    # ----------------- 准入 -----------------
+    def _admit(self, lane: _Lane, priority: int, name: str, deadline: float) -> Optional[_Waiter]:
+        """返回 None 表示可以立即执行，否则返回已入队的 waiter；无法接纳时抛 SchedulerRejected。"""
+        now = time.monotonic()
+        if not lane.heap and lane.running < lane.slot_limit(priority):
+            lane.running += 1
+            return None
+
+        ahead = sum(1 for w in lane.heap if w.priority <= priority and not w.future.done())
+        if now + lane.estimated_wait(ahead) > deadline:
+            lane.counters["rejected"] += 1
+            raise SchedulerRejected(503, f"Model '{lane.model}' is saturated: estimated wait exceeds the deadline.", lane.retry_after())
+
+        if name == "batch" and lane.queued["batch"] >= lane.max_batch_queue:
+            lane.counters["rejected"] += 1
+            raise SchedulerRejected(429, f"Batch queue for model '{lane.model}' is full.", lane.retry_after())
+
+        if len(lane.heap) >= lane.max_queue and not (name == "interactive" and self._evict_batch(lane)):
+            lane.counters["rejected"] += 1
+            raise SchedulerRejected(429, f"Queue for model '{lane.model}' is full.", lane.retry_after())
+
+        waiter = _Waiter(priority, next(self._seq), deadline, now, asyncio.get_running_loop().create_future())
+        heapq.heappush(lane.heap, waiter)
+        lane.queued[name] += 1
+        self._dispatch(lane)  # 队列里可能只剩已失效的 waiter，空闲槽位直接交给新请求
+        return waiter
+
+    def _evict_batch(self, lane: _Lane) -> bool:
+        """队列已满时挤掉最晚入队的 batch 请求，给 interactive 腾位置。"""
+        victims = [w for w in lane.heap if w.priority == PRIORITIES["batch"] and not w.future.done()]
+        if not victims:
+            return False
+        victim = max(victims, key=lambda w: w.seq)
+        victim.future.set_exception(
+            SchedulerRejected(503, f"Evicted from the queue of model '{lane.model}' by interactive traffic.", lane.retry_after())
+        )
+        self._remove(lane, victim)
+        lane.counters["evicted"] += 1
+        return True
+
+    def _remove(self, lane: _Lane, waiter: _Waiter) -> None:
+        try:
+            lane.heap.remove(waiter)
+        except ValueError:
+            return
+        heapq.heapify(lane.heap)
+        lane.queued["interactive" if waiter.priority == PRIORITIES["interactive"] else "batch"] -= 1
+
+    # ----------------- 出队 -----------------
+    def _dispatch(self, lane: _Lane) -> None:
+        now = time.monotonic()
+        while lane.heap:
+            waiter = lane.heap[0]
+            if waiter.future.done():  # 已超时 / 已取消 / 已被挤掉
+                self._remove(lane, waiter)
+                continue
+            if waiter.deadline <= now:
+                self._remove(lane, waiter)
+                lane.counters["expired"] += 1
+                waiter.future.set_exception(
+                    SchedulerRejected(504, f"Deadline expired while queued for model '{lane.model}'.", lane.retry_after())
+                )
+                continue
+            # 堆顶是 batch 说明没有 interactive 在等，但 batch 不能占用预留槽位
+            if lane.running >= lane.slot_limit(waiter.priority):
+                return
+            self._remove(lane, waiter)
+            lane.running += 1
+            waiter.future.set_result(None)
+
+    async def _wait_turn(self, lane: _Lane, waiter: _Waiter, name: str) -> None:
+        remaining = waiter.deadline - time.monotonic()
+        try:
+            done, _ = await asyncio.wait({waiter.future}, timeout=max(0.0, remaining))
+        except asyncio.CancelledError:
+            # 客户端断开：若已拿到槽位则归还
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                lane.running -= 1
+                self._dispatch(lane)
+            else:
+                waiter.future.cancel()
+                self._remove(lane, waiter)
+            raise
+        if not done:
+            waiter.future.cancel()
+            self._remove(lane, waiter)
+            lane.counters["expired"] += 1
+            raise SchedulerRejected(504, f"Deadline expired while queued for model '{lane.model}'.", lane.retry_after())
+        waiter.future.result()  # 被挤掉 / 过期时抛出 SchedulerRejected
+        lane.waits[name].append(time.monotonic() - waiter.enqueued_at)
+
+    # ----------------- 对外接口 -----------------
+    async def run(
+        self,
+        model: str,
+        fn: Callable[..., Any],
+        /,
+        *args: Any,
+        priority: str = "interactive",
+        deadline_ms: Optional[int] = None,
+        **kwargs: Any,
+    ) -> Any:
+        """按调度在线程池中执行 fn(*args, **kwargs)。"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}', expected one of {list(PRIORITIES)}")
+        lane = self._lane(model)
+        deadline = time.monotonic() + (deadline_ms or self.default_deadline_ms) / 1000.0
+
+        waiter = self._admit(lane, PRIORITIES[priority], priority, deadline)
+        if waiter is None:
+            lane.waits[priority].append(0.0)
+        else:
+            await self._wait_turn(lane, waiter, priority)
+
+        lane.counters["admitted"] += 1
+        started = time.monotonic()
+        # 客户端断开时线程里的生成仍在进行，槽位要等它真正结束才归还
+        task = asyncio.ensure_future(run_in_threadpool(fn, *args, **kwargs))
+        task.add_done_callback(lambda t: self._finish(lane, t, started))
+        return await asyncio.shield(task)
+
+    def _finish(self, lane: _Lane, task: asyncio.Future, started: float) -> None:
+        failed = task.cancelled() or task.exception() is not None
+        lane.counters["failed" if failed else "completed"] += 1
+        lane.service_ewma = 0.8 * lane.service_ewma + 0.2 * (time.monotonic() - started)
+        lane.running -= 1
+        self._dispatch(lane)
+
+    def stats(self) -> Dict[str, Any]:
+        models = {}
+        for model, lane in self._lanes.items():
+            models[model] = {
+                "running": lane.running,
+                "max_concurrency": lane.max_concurrency,
+                "queued": dict(lane.queued),
+                "max_queue": lane.max_queue,
+                "avg_service_ms": round(lane.service_ewma * 1000, 1),
+                "wait_ms": {
+                    name: {
+                        "p50": round(_percentile(list(waits), 0.5) * 1000, 1),
+                        "p95": round(_percentile(list(waits), 0.95) * 1000, 1),
+                        "samples": len(waits),
+                    }
+                    for name, waits in lane.waits.items()
+                },
+                **lane.counters,
+            }
+        return {"models": models}
@@ -1,17 +1,18 @@
 # server.py
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from fastapi.concurrency import run_in_threadpool
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import os
 import shutil
 import asyncio
 import functools
-from typing import Generator, Any, Optional, Dict, List
+import tempfile
+from typing import Generator, Any, Optional, Dict, List, Literal
 from chat import initialize_rag_chain, QdrantRAGChain
 from contextlib import asynccontextmanager # 👈 1. Import asynccontextmanager
-import ollama
 import sys
 
 # --- Global variable ---
@@ -43,7 +44,25 @@ from langchain_ollama import ChatOllama
 from build_or_get_vectorstore_qrant import (
     build_or_get_vectorstore,
     semantic_search_with_custom_scoring,
+    get_tenant_dir,
+    validate_tenant_id,
 )
+from manifest import list_manifests
+from snapshot import export_snapshot, restore_snapshot, SnapshotCompatibilityError
+from config import (
+    DEFAULT_TENANT,
+    GENERATION_MAX_CONCURRENCY,
+    GENERATION_MAX_QUEUE,
+    GENERATION_MAX_BATCH_QUEUE,
+    GENERATION_INTERACTIVE_RESERVED,
+    GENERATION_DEFAULT_DEADLINE_MS,
+    OLLAMA_ENDPOINTS,
+    PROFILING_ENABLED,
+    PROFILING_MAX_SAMPLE_SECONDS,
+)
+from scheduler import GenerationScheduler, SchedulerRejected
+from profiling import profile_call, StackSampler, AllocationTracker, collapsed_stacks
+from ollama_pool import get_pool
 
 app = FastAPI(
     title="RAG Q&A API",
@@ -52,7 +71,14 @@ app = FastAPI(
 )
 
 # --- 配置 ---
-BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_base")
+def resolve_tenant_dir(tenant_id: str) -> str:
+    """返回 tenant 的知识库目录（不存在则创建），非法 tenant ID 返回 400。"""
+    try:
+        directory = str(get_tenant_dir(tenant_id))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    os.makedirs(directory, exist_ok=True)
+    return directory
 LLM_MODEL_NAME = "gemma3:latest" # Define the model name here
 
 # --- CORS 中间件 ---
@@ -64,6 +90,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- LLM 生成调度器：有界队列 + 优先级 + deadline ---
+scheduler = GenerationScheduler(
+    max_concurrency=GENERATION_MAX_CONCURRENCY * len(OLLAMA_ENDPOINTS),  # 每个 Ollama 节点各 GENERATION_MAX_CONCURRENCY 路
+    max_queue=GENERATION_MAX_QUEUE,
+    max_batch_queue=GENERATION_MAX_BATCH_QUEUE,
+    interactive_reserved=GENERATION_INTERACTIVE_RESERVED,
+    default_deadline_ms=GENERATION_DEFAULT_DEADLINE_MS,
+)
+
+# --- 按需 profiling（默认关闭） ---
+stack_sampler = StackSampler()
+allocation_tracker = AllocationTracker()
+
+def require_profiling():
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiling is disabled (set RAG_PROFILING=1 to enable).")
+
 
 # --- Pydantic model definitions ---
 class QueryRequest(BaseModel):
@@ -72,6 +115,11 @@ class QueryRequest(BaseModel):
     file_filters: Optional[List[str]] = None # file type filters, e.g., ["pdf", "docx"]
     preferred_sources: Optional[List[str]] = None 
     model: Optional[str] = None # Renamed from preferred_model for clarity
+    tenant_id: str = DEFAULT_TENANT # only this tenant's partition is searched
+    session_id: Optional[str] = None # keep conversation memory and reuse context for follow-ups
+    priority: Literal["interactive", "batch"] = "interactive" # batch callers absorb backpressure first
+    deadline_ms: Optional[int] = Field(default=None, gt=0) # dropped if still queued after this many ms
+    profile: bool = False # return a sampled profile of this request's worker thread (requires PROFILING_ENABLED)
 
 
 class SourceDocument(BaseModel):
@@ -82,6 +130,8 @@ class SourceDocument(BaseModel):
 class AnswerResponse(BaseModel):
     answer: str
     sources: List[SourceDocument]
+    session_id: Optional[str] = None
+    profile: Optional[Dict[str, Any]] = None
 
 # --- 异步生成器包装器 ---
 async def to_async_generator(sync_gen: Generator[Any, None, Any]):
@@ -96,44 +146,50 @@ async def to_async_generator(sync_gen: Generator[Any, None, Any]):
 # --- API 端点 ---
 
 @app.get("/files")
-async def list_files():
-    """读取 knowledge_base 文件夹下所有文件"""
-    if not os.path.exists(BASE_DIR):
-        os.makedirs(BASE_DIR)
+async def list_files(tenant_id: str = DEFAULT_TENANT):
+    """读取 tenant 知识库目录下所有文件"""
+    tenant_dir = resolve_tenant_dir(tenant_id)
     try:
-        filenames = await run_in_threadpool(os.listdir, BASE_DIR)
-        files = [{"name": f, "path": os.path.join(BASE_DIR, f)} for f in filenames]
+        filenames = await run_in_threadpool(os.listdir, tenant_dir)
+        files = [
+            {"name": f, "path": os.path.join(tenant_dir, f)}
+            for f in filenames
+            if os.path.isfile(os.path.join(tenant_dir, f))
+        ]
         return JSONResponse(content=files)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"无法读取文件列表: {e}")
 
-@app.post("/upload")
-async def upload_files(files: list[UploadFile] = File(...)):
-    """上传文件到 knowledge_base"""
-    if not os.path.exists(BASE_DIR):
-        os.makedirs(BASE_DIR)
+@app.get("/tenants")
+async def list_tenants():
+    """列出已有 ingest manifest 的 tenant 及其文件/chunk 数"""
+    return JSONResponse(content=await run_in_threadpool(list_manifests))
 
+@app.post("/upload")
+async def upload_files(files: list[UploadFile] = File(...), tenant_id: str = DEFAULT_TENANT):
+    """上传文件到 tenant 知识库目录"""
+    tenant_dir = resolve_tenant_dir(tenant_id)
 
     def save_file(uploaded_file: UploadFile):
         filename = uploaded_file.filename
         if not filename:
             raise HTTPException(status_code=400, detail="Uploaded file is missing a filename")
         safe_filename = os.path.basename(filename)
-        file_path = os.path.join(BASE_DIR, safe_filename)
+        file_path = os.path.join(tenant_dir, safe_filename)
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(uploaded_file.file, buffer)
 
     await asyncio.gather(*(run_in_threadpool(save_file, f) for f in files))
-    return await list_files()
+    return await list_files(tenant_id)
 
 
 @app.delete("/delete")
-async def delete_file(filename: str):
+async def delete_file(filename: str, tenant_id: str = DEFAULT_TENANT):
     """删除指定文件"""
     if "/" in filename or "\\" in filename or ".." in filename:
         raise HTTPException(status_code=400, detail="无效的文件名")
         
-    file_path = os.path.join(BASE_DIR, filename)
+    file_path = os.path.join(resolve_tenant_dir(tenant_id), filename)
 
     def do_delete():
         if not os.path.exists(file_path):
@@ -145,30 +201,28 @@ async def delete_file(filename: str):
 
     await run_in_threadpool(do_delete)
     
-    return await list_files()
+    return await list_files(tenant_id)
 
 @app.get("/models")
 async def get_ollama_models():
     """
-    Fetches the list of locally installed Ollama models.
+    Fetches the list of Ollama models installed on the healthy endpoints of the pool.
     """
     try:
-        response = ollama.list()
-        
-        # DEBUG: You can keep or remove this line now that we've found the issue.
-        print(f"DEBUG: Raw response from ollama.list(): {response}") 
-        
-        # --- 👇 CORRECTED LINE 👇 ---
-        # Access the list with `response.models` and each model name with `m.model`
-        installed_models = [m.model for m in response.models]
+        models_by_endpoint = await run_in_threadpool(get_pool().list_models)
+        if not models_by_endpoint:
+            raise HTTPException(status_code=503, detail="No Ollama endpoint is reachable.")
+
+        installed_models = sorted(set().union(*models_by_endpoint.values()))
         
         if not installed_models:
-            print("Warning: No local Ollama models found inside the endpoint.")
+            print("Warning: No Ollama models found on any endpoint.")
             return {"models": []}
             
         return {"models": installed_models}
+    except HTTPException:
+        raise
     except Exception as e:
-        # This will now catch other potential errors, but not the KeyError
         print(f"Error processing Ollama models: {e}", file=sys.stderr)
         raise HTTPException(
             status_code=500,
@@ -176,15 +230,21 @@ async def get_ollama_models():
         )
 
 @app.get("/embed-stream")
-async def embed_stream():
+async def embed_stream(tenant_id: str = DEFAULT_TENANT):
     """
     使用 Server-Sent Events (SSE) 实时流式传输 embedding 过程的日志。
     (已优化为非阻塞)
+    只重建该 tenant 的分区，其它 tenant 不受影响。
     """
+    try:
+        tenant_id = validate_tenant_id(tenant_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     async def event_generator():
         try:
             log_generator = build_or_get_vectorstore(
-                mode="server", recreate=True, source_type="all"
+                mode="server", recreate=True, source_type="all", tenant_id=tenant_id
             )
             
             async for log_message in to_async_generator(log_generator):
@@ -208,20 +268,50 @@ async def ask_question(request: QueryRequest):
     """
     if rag_chain is None:
         raise HTTPException(status_code=503, detail="RAG Chain is not available or failed to initialize.")
+    try:
+        validate_tenant_id(request.tenant_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if request.profile:
+        require_profiling()
+    if request.model and request.model != rag_chain.llm.model:
+        # 模型名来自客户端：先确认它装在某个 Ollama 节点上，避免为任意字符串创建调度 lane 与 client
+        known = await run_in_threadpool(get_pool().known_models)
+        if not known:
+            raise HTTPException(status_code=503, detail="No Ollama endpoint is reachable.")
+        if request.model not in known and f"{request.model}:latest" not in known:
+            raise HTTPException(status_code=400, detail=f"Model '{request.model}' is not installed on any Ollama endpoint.")
     
     try:
         # The RAG chain's invoke method is synchronous
-        # Run it in a thread pool to prevent blocking FastAPI's asynchronous event loop
-        print(f"收到的查询: '{request.query}', 文件过滤器: {request.file_filters}")
-        answer, results = await run_in_threadpool(
-            rag_chain.invoke, 
+        # The scheduler runs it in a thread pool once the model has a free slot
+        print(f"收到的查询: '{request.query}', tenant: {request.tenant_id}, 文件过滤器: {request.file_filters}")
+        invoke_kwargs = dict(
             query=request.query, 
             top_k=request.top_k,
             file_filters=request.file_filters, 
-            model=request.model  
-
-
+            model=request.model,
+            tenant_id=request.tenant_id,
+            session_id=request.session_id,
         )
+        profile = None
+        if request.profile:
+            (answer, results), profile = await scheduler.run(
+                request.model or rag_chain.llm.model,
+                profile_call,
+                rag_chain.invoke,
+                priority=request.priority,
+                deadline_ms=request.deadline_ms,
+                **invoke_kwargs,
+            )
+        else:
+            answer, results = await scheduler.run(
+                request.model or rag_chain.llm.model,
+                rag_chain.invoke,
+                priority=request.priority,
+                deadline_ms=request.deadline_ms,
+                **invoke_kwargs,
+            )
 
         formatted_sources = []
         for res in results:
@@ -235,14 +325,126 @@ async def ask_question(request: QueryRequest):
                     )
                 )
 
-        return AnswerResponse(answer=answer, sources=formatted_sources)
+        return AnswerResponse(answer=answer, sources=formatted_sources, session_id=request.session_id, profile=profile)
 
+    except SchedulerRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         # Capture any exceptions that may occur in the RAG chain
         print(f"Error during query processing: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """每个模型的运行数、排队深度（按优先级）、等待时间分位数与拒绝/过期计数"""
+    return scheduler.stats()
+
+
+@app.get("/ollama/endpoints")
+async def ollama_endpoints():
+    """Ollama endpoint 池状态：熔断状态、在途请求数、延迟与错误计数"""
+    return {"endpoints": get_pool().stats()}
+
+
+@app.get("/debug/profile/sample", dependencies=[Depends(require_profiling)])
+async def sample_profile(seconds: float = 10.0, interval_ms: float = 5.0, include_idle: bool = False):
+    """
+    限时统计采样所有线程的调用栈，返回 collapsed stacks（flamegraph.pl / speedscope 可直接读取）。
+    在 /query 或 /embed-stream 变慢时调用。
+    """
+    if not 0 < seconds <= PROFILING_MAX_SAMPLE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {PROFILING_MAX_SAMPLE_SECONDS}]")
+    try:
+        stacks, rounds = await run_in_threadpool(stack_sampler.sample, seconds, max(interval_ms, 1.0), include_idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(collapsed_stacks(stacks), headers={"X-Profile-Samples": str(rounds)})
+
+
+@app.post("/debug/tracemalloc/start", dependencies=[Depends(require_profiling)])
+async def tracemalloc_start(frames: int = 25):
+    """开始跟踪内存分配（并记录基线），之后的快照都与基线比较"""
+    allocation_tracker.start(frames)
+    return {"tracing": True, "frames": frames}
+
+
+@app.get("/debug/tracemalloc/snapshot", dependencies=[Depends(require_profiling)])
+async def tracemalloc_snapshot(limit: int = 25, group_by: Literal["lineno", "filename", "traceback"] = "lineno"):
+    """相对基线增长最多的分配位置，例如在 /embed-stream 运行期间调用"""
+    try:
+        return await run_in_threadpool(allocation_tracker.snapshot, limit, group_by)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/debug/tracemalloc/stop", dependencies=[Depends(require_profiling)])
+async def tracemalloc_stop():
+    allocation_tracker.stop()
+    return {"tracing": False}
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str, tenant_id: str = DEFAULT_TENANT):
+    """结束会话，释放其记忆与缓存的检索结果（只删除该 tenant 下的会话）"""
+    if rag_chain is None:
+        raise HTTPException(status_code=503, detail="RAG Chain is not available or failed to initialize.")
+    try:
+        tenant_id = validate_tenant_id(tenant_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not rag_chain.sessions.delete(tenant_id, session_id):
+        raise HTTPException(status_code=404, detail="会话不存在")
+    return {"deleted": session_id}
+
+
+def _drain_logs(generator: Generator[str, None, Any]) -> List[str]:
+    logs = []
+    while True:
+        try:
+            logs.append(next(generator))
+        except StopIteration:
+            return logs
+
+
+@app.get("/snapshot/export")
+async def snapshot_export(tenant_id: Optional[str] = None):
+    """导出索引快照（gzip JSONL），新节点可通过 /snapshot/restore 直接加载，无需重新 embedding"""
+    if tenant_id is not None:
+        try:
+            tenant_id = validate_tenant_id(tenant_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    fd, path = tempfile.mkstemp(suffix=".jsonl.gz")
+    os.close(fd)
+    try:
+        vector_store = rag_chain.vectorstore if rag_chain is not None else None
+        await run_in_threadpool(_drain_logs, export_snapshot(path, mode="server", tenant_id=tenant_id, vector_store=vector_store))
+    except Exception as e:
+        os.remove(path)
+        raise HTTPException(status_code=500, detail=f"导出快照失败: {e}")
+
+    filename = f"{tenant_id or 'all'}.snapshot.jsonl.gz"
+    return FileResponse(path, media_type="application/gzip", filename=filename, background=BackgroundTask(os.remove, path))
+
+
+@app.post("/snapshot/restore")
+async def snapshot_restore(file: UploadFile = File(...)):
+    """从上传的快照恢复索引（覆盖快照中包含的 tenant 分区）"""
+    fd, path = tempfile.mkstemp(suffix=".jsonl.gz")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            await run_in_threadpool(shutil.copyfileobj, file.file, buffer)
+        logs = await run_in_threadpool(_drain_logs, restore_snapshot(path, mode="server"))
+    except SnapshotCompatibilityError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"恢复快照失败: {e}")
+    finally:
+        os.remove(path)
+    return {"logs": logs}
+
 
 if __name__ == "__main__":
     import uvicorn
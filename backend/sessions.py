@@ -0,0 +1,95 @@
+# sessions.py
+"""
+- 会话记忆：保存最近几轮的 query、chunk IDs 和回答；完整检索结果与 query 向量只保留在最近一轮
+- 有界的内存存储：超过 max_sessions 时按 LRU 淘汰，超过 ttl_seconds 未访问的会话过期
+- 会话按 (tenant_id, session_id) 存储：不同 tenant 使用相同的 session_id 也互不可见
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional, Tuple
+
+
+@dataclass
+class Turn:
+    query: str
+    query_vector: List[float]
+    results: List[dict]
+    answer: str
+    tenant_id: Optional[str] = None
+    file_filters: Optional[List[str]] = None
+    top_k: int = 6
+    chunk_ids: List[str] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class Session:
+    session_id: str
+    tenant_id: str
+    turns: Deque[Turn]
+    last_access: float = field(default_factory=time.time)
+
+    @property
+    def last_turn(self) -> Optional[Turn]:
+        return self.turns[-1] if self.turns else None
+
+    def add_turn(self, turn: Turn) -> None:
+        # 只有最近一轮的检索结果（可能含展开后的父段落）和 query 向量会被复用，更早的轮次只保留 chunk_ids
+        if self.turns:
+            previous = self.turns[-1]
+            previous.results = []
+            previous.query_vector = []
+        self.turns.append(turn)
+        self.last_access = time.time()
+
+
+class SessionStore:
+    """
+    线程安全的会话存储（OrderedDict 实现 LRU）。
+    """
+    def __init__(self, max_sessions: int = 1000, max_turns: int = 8, ttl_seconds: float = 1800):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[Tuple[str, str], Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, tenant_id: str, session_id: str) -> Session:
+        key = (tenant_id, session_id)
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.get(key)
+            if session is None:
+                session = Session(session_id=session_id, tenant_id=tenant_id, turns=deque(maxlen=self.max_turns))
+                self._sessions[key] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(key)
+            session.last_access = time.time()
+            return session
+
+    def delete(self, tenant_id: str, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop((tenant_id, session_id), None) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict_expired(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        # OrderedDict 按访问顺序排列，最旧的在前面
+        while self._sessions:
+            oldest_key, oldest = next(iter(self._sessions.items()))
+            if oldest.last_access >= cutoff:
+                break
+            del self._sessions[oldest_key]
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
@@ -0,0 +1,126 @@
+# sharding.py
+"""
+- 多个独立 Qdrant 实例（非 Qdrant 集群）时的客户端分片路由
+- 写入：按 metadata.source 的稳定哈希选分片，同一文件的 chunk 都落在同一个实例上
+- 查询：query 只 embedding 一次，并行发到所有分片，按相似度合并后取 top-k，再交给自定义重排序
+- Qdrant 集群模式请改用 collection 自带的分片 / 副本（config.QDRANT_SHARD_NUMBER 等），不需要这里的路由
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as qmodels
+
+
+def shard_index(source: Any, num_shards: int) -> int:
+    """
+    稳定哈希（不受 PYTHONHASHSEED 影响），进程重启后同一来源仍映射到同一分片。
+    不用 crc32：它是线性的，只差一个字符的文件名（a.txt / b.txt）低位相同，取模后会挤在同一分片。
+    """
+    digest = hashlib.md5(str(source or "").encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def _inner_store(store: Any) -> QdrantVectorStore:
+    # BatchedVectorStore 等包装通过 vector_store 属性持有真正的 QdrantVectorStore
+    return getattr(store, "vector_store", store)
+
+
+class ShardedVectorStore:
+    """
+    一组同构的 QdrantVectorStore（相同 collection 名与向量维度，各自连不同实例）。
+    shards 也可以是 BatchedVectorStore，查询时优先调用其 similarity_search_with_score_by_vector。
+    """
+    def __init__(self, shards: Sequence[Any], embeddings: Optional[Embeddings] = None, max_workers: int = 8):
+        if not shards:
+            raise ValueError("ShardedVectorStore needs at least one shard")
+        self.shards = list(shards)
+        self.embeddings = embeddings or _inner_store(self.shards[0]).embeddings
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(self.shards) * 2)), thread_name_prefix="shard-search"
+        )
+
+    @property
+    def clients(self) -> List[QdrantClient]:
+        return [_inner_store(s).client for s in self.shards]
+
+    @property
+    def collection_name(self) -> str:
+        return _inner_store(self.shards[0]).collection_name
+
+    def shard_for(self, doc: Document) -> int:
+        return shard_index(doc.metadata.get("source"), len(self.shards))
+
+    # ----------------- 写入 -----------------
+    def add_documents(self, documents: List[Document], ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        ids = list(ids) if ids is not None else [None] * len(documents)
+        groups: Dict[int, Tuple[List[Document], List[Any]]] = {}
+        for doc, point_id in zip(documents, ids):
+            docs, group_ids = groups.setdefault(self.shard_for(doc), ([], []))
+            docs.append(doc)
+            group_ids.append(point_id)
+
+        def add(item: Tuple[int, Tuple[List[Document], List[Any]]]) -> List[str]:
+            index, (docs, group_ids) = item
+            store = _inner_store(self.shards[index])
+            return store.add_documents(docs, ids=group_ids if all(group_ids) else None, **kwargs)
+
+        added: List[str] = []
+        for result in self._executor.map(add, groups.items()):
+            added.extend(result)
+        return added
+
+    # ----------------- 查询 -----------------
+    @staticmethod
+    def _search_shard(
+        shard: Any, embedding: List[float], k: int, filter: Optional[qmodels.Filter]
+    ) -> List[Tuple[Document, float]]:
+        if hasattr(shard, "similarity_search_with_score_by_vector"):
+            return shard.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+        response = shard.client.query_points(
+            collection_name=shard.collection_name,
+            query=embedding,
+            using=shard.vector_name or None,
+            query_filter=filter,
+            limit=k,
+            with_payload=True,
+        )
+        return [
+            (
+                QdrantVectorStore._document_from_point(
+                    point, shard.collection_name, shard.content_payload_key, shard.metadata_payload_key
+                ),
+                point.score,
+            )
+            for point in response.points
+        ]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[qmodels.Filter] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """并行查询所有分片（每个分片取 k 条），按分数合并后返回全局 top-k。"""
+        futures = [self._executor.submit(self._search_shard, shard, embedding, k, filter) for shard in self.shards]
+        merged: List[Tuple[Document, float]] = []
+        for index, future in enumerate(futures):
+            try:
+                merged.extend(future.result())
+            except Exception as e:
+                # 单个分片不可用时返回其余分片的结果，而不是让整个查询失败
+                print(f"Warning: shard {index} search failed: {e}")
+        merged.sort(key=lambda pair: pair[1], reverse=True)
+        return merged[:k]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[qmodels.Filter] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        embedding = self.embeddings.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k=k, filter=filter, **kwargs)
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[qmodels.Filter] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter, **kwargs)]
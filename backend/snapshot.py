@@ -0,0 +1,338 @@
+# snapshot.py
+"""
+- 索引快照导出 / 恢复：新节点直接加载快照，无需重新 embedding 整个知识库
+- 快照是单个 gzip 压缩的 JSONL 流：header -> manifests -> docstore -> points -> footer
+- 向量以 base64(float32) 存储；导出与恢复都是逐条流式读写，不会把整个 collection 读进内存
+- 恢复时校验 embedding 模型与向量维度，可恢复到 server / disk / memory 任一模式
+
+用法:
+  python snapshot.py export knowledge_base.snapshot.jsonl.gz [--mode server] [--tenant acme]
+  python snapshot.py restore knowledge_base.snapshot.jsonl.gz [--mode disk]
+"""
+from config import *
+import argparse
+import base64
+import gzip
+import itertools
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, Generator, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import PointStruct
+
+from build_or_get_vectorstore_qrant import (
+    get_backend,
+    get_clients,
+    ensure_collection,
+    get_docstore,
+    tenant_filter,
+    validate_tenant_id,
+    _purge_points,
+)
+from manifest import MANIFEST_DIR, load_manifest, save_manifest
+from numpy_store import NumpyVectorStore
+from ollama_pool import pooled_embeddings
+from sharding import ShardedVectorStore, shard_index
+
+SNAPSHOT_FORMAT = "qdrant-local-rag-snapshot"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_BATCH_SIZE = 256
+
+
+class SnapshotCompatibilityError(ValueError):
+    """快照与当前 embedding 模型 / 目标 collection 不兼容。"""
+
+
+def _encode_vector(vector: Any) -> str:
+    return base64.b64encode(np.asarray(vector, dtype="<f4").tobytes()).decode("ascii")
+
+
+def _decode_vector(data: str) -> List[float]:
+    return np.frombuffer(base64.b64decode(data), dtype="<f4").tolist()
+
+
+def _write(f, record: Dict[str, Any]) -> None:
+    f.write(json.dumps(record, ensure_ascii=False, default=str))
+    f.write("\n")
+
+
+# ----------------- Export -----------------
+def _iter_qdrant_points(client: QdrantClient, tenant_id: Optional[str]) -> Iterator[Tuple[Any, Any, Dict[str, Any]]]:
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=QDRANT_COLLECTION,
+            scroll_filter=tenant_filter(tenant_id) if tenant_id else None,
+            limit=SNAPSHOT_BATCH_SIZE,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        for point in points:
+            vector = point.vector
+            if isinstance(vector, dict):
+                vector = vector.get("") or next(iter(vector.values()))
+            yield point.id, vector, point.payload or {}
+        if offset is None:
+            break
+
+
+def _iter_numpy_points(store: NumpyVectorStore, tenant_id: Optional[str]) -> Iterator[Tuple[Any, Any, Dict[str, Any]]]:
+    for point_id, vector, doc in store.iter_records():
+        if tenant_id and doc.metadata.get(TENANT_PAYLOAD_KEY) != tenant_id:
+            continue
+        yield point_id, vector, {"page_content": doc.page_content, "metadata": doc.metadata}
+
+
+def _snapshot_tenants(tenant_id: Optional[str]) -> List[str]:
+    if tenant_id:
+        return [tenant_id]
+    if not MANIFEST_DIR.exists():
+        return []
+    return sorted(path.stem for path in MANIFEST_DIR.glob("*.json"))
+
+
+def export_snapshot(
+    output_path: str,
+    mode: str = "server",
+    tenant_id: Optional[str] = None,
+    vector_store: Any = None,
+) -> Generator[str, None, Dict[str, Any]]:
+    """
+    导出 collection（或单个 tenant 的分区）+ ingest manifest + parent docstore。
+    vector_store 为 None 时按 mode 打开（memory 模式必须传入已有的 vector_store）。
+    """
+    if tenant_id:
+        tenant_id = validate_tenant_id(tenant_id)
+
+    backend = get_backend(mode)
+    if vector_store is None:
+        if mode == "memory":
+            raise ValueError("Exporting memory mode requires the live vector_store.")
+        if backend == "numpy":
+            if not (Path(NUMPY_STORE_PATH) / "meta.json").exists():
+                raise ValueError(f"No numpy store found at '{NUMPY_STORE_PATH}'.")
+            vector_store = NumpyVectorStore(None, 0, path=NUMPY_STORE_PATH)
+    # BatchedVectorStore 等包装透传到内部的 vector store
+    vector_store = getattr(vector_store, "vector_store", vector_store)
+
+    if isinstance(vector_store, NumpyVectorStore):
+        vector_size = vector_store.dim
+        points = _iter_numpy_points(vector_store, tenant_id)
+    else:
+        # 客户端分片时依次导出每个实例，恢复时再按 source 重新分片
+        if vector_store is None:
+            clients = get_clients(mode)
+        elif isinstance(vector_store, ShardedVectorStore):
+            clients = vector_store.clients
+        else:
+            clients = [vector_store.client]
+        info = clients[0].get_collection(collection_name=QDRANT_COLLECTION)
+        vector_size = info.config.params.vectors.size
+        points = itertools.chain.from_iterable(_iter_qdrant_points(c, tenant_id) for c in clients)
+
+    tenants = _snapshot_tenants(tenant_id)
+    manifests = {t: load_manifest(t) for t in tenants}
+    models = {m.get("embedding_model") for m in manifests.values() if m.get("embedding_model")}
+    if len(models) > 1:
+        raise SnapshotCompatibilityError(f"Manifests reference several embedding models: {sorted(models)}")
+    embedding_model = models.pop() if models else EMBEDDING_MODEL_NAME
+
+    yield f"Exporting '{QDRANT_COLLECTION}' ({backend}, size={vector_size}) to '{output_path}'..."
+    point_count = 0
+    with gzip.open(output_path, "wt", encoding="utf-8") as f:
+        _write(f, {
+            "type": "header",
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "created_at": time.time(),
+            "collection": QDRANT_COLLECTION,
+            "embedding_model": embedding_model,
+            "vector_size": vector_size,
+            "distance": "Cosine",
+            "tenant_id": tenant_id,
+        })
+        for t, manifest in manifests.items():
+            _write(f, {"type": "manifest", "tenant_id": t, "manifest": manifest})
+            if manifest.get("parent_document"):
+                docstore = get_docstore(t)
+                for key in docstore.yield_keys():
+                    doc = docstore.mget([key])[0]
+                    if doc is not None:
+                        _write(f, {
+                            "type": "docstore",
+                            "tenant_id": t,
+                            "key": key,
+                            "document": {"page_content": doc.page_content, "metadata": doc.metadata},
+                        })
+
+        for point_id, vector, payload in points:
+            _write(f, {"type": "point", "id": point_id, "vector": _encode_vector(vector), "payload": payload})
+            point_count += 1
+            if point_count % (SNAPSHOT_BATCH_SIZE * 40) == 0:
+                yield f"Exported {point_count} points..."
+
+        _write(f, {"type": "footer", "points": point_count})
+
+    yield f"Snapshot complete: {point_count} points, {len(manifests)} manifest(s)."
+    return {"path": output_path, "points": point_count, "tenants": list(manifests)}
+
+
+# ----------------- Restore -----------------
+def _check_compatibility(header: Dict[str, Any], verify_embedding: bool) -> int:
+    if header.get("format") != SNAPSHOT_FORMAT or header.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotCompatibilityError(f"Unsupported snapshot format: {header.get('format')} v{header.get('version')}")
+    if header.get("embedding_model") != EMBEDDING_MODEL_NAME:
+        raise SnapshotCompatibilityError(
+            f"Snapshot was embedded with '{header.get('embedding_model')}', current model is '{EMBEDDING_MODEL_NAME}'."
+        )
+    vector_size = header["vector_size"]
+    if verify_embedding:
+        live_size = len(pooled_embeddings(EMBEDDING_MODEL_NAME).embed_query("hello world"))
+        if live_size != vector_size:
+            raise SnapshotCompatibilityError(
+                f"Snapshot vector size {vector_size} != current embedding size {live_size}."
+            )
+    return vector_size
+
+
+def restore_snapshot(
+    input_path: str,
+    mode: str = "server",
+    verify_embedding: bool = True,
+) -> Generator[str, None, Any]:
+    """
+    把快照加载到 server / disk / memory 模式。快照中出现的每个 tenant 在写入前先清空其分区。
+    返回可直接检索的 vector store（QdrantVectorStore、ShardedVectorStore 或 NumpyVectorStore）。
+    """
+    backend = get_backend(mode)
+    embeddings = pooled_embeddings(EMBEDDING_MODEL_NAME)
+    persist_manifest = mode != "memory"
+
+    with gzip.open(input_path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("type") != "header":
+            raise SnapshotCompatibilityError("Snapshot is missing its header.")
+        vector_size = _check_compatibility(header, verify_embedding)
+        yield f"Restoring snapshot of '{header['collection']}' (size={vector_size}) into {mode} mode ({backend})..."
+
+        if backend == "numpy":
+            store, reset = NumpyVectorStore.open(
+                embeddings, vector_size, path=NUMPY_STORE_PATH if mode == "disk" else None, dtype=NUMPY_STORE_DTYPE
+            )
+            if reset:
+                yield f"Warning: numpy store at '{NUMPY_STORE_PATH}' had a different vector size/dtype, recreated it."
+            purge_target: Any = store
+        else:
+            clients = get_clients(mode)
+            for client in clients:
+                if client.collection_exists(QDRANT_COLLECTION):
+                    existing_size = client.get_collection(collection_name=QDRANT_COLLECTION).config.params.vectors.size
+                    if existing_size != vector_size:
+                        raise SnapshotCompatibilityError(
+                            f"Target collection '{QDRANT_COLLECTION}' has vector size {existing_size}, snapshot has {vector_size}."
+                        )
+            for client in clients:
+                ensure_collection(client, vector_size, mode)
+            shards = [QdrantVectorStore(client=c, collection_name=QDRANT_COLLECTION, embedding=embeddings) for c in clients]
+            store = ShardedVectorStore(shards, embeddings) if len(shards) > 1 else shards[0]
+            purge_target = store if len(shards) > 1 else clients[0]
+
+        cleared = set()
+
+        def clear_tenant(t: str) -> None:
+            if t not in cleared:
+                _purge_points(purge_target, t)
+                cleared.add(t)
+
+        batch: List[Dict[str, Any]] = []
+
+        def flush_batch() -> None:
+            if not batch:
+                return
+            if backend == "numpy":
+                store.add_embeddings(
+                    [r["id"] for r in batch],
+                    np.stack([np.asarray(_decode_vector(r["vector"]), dtype=np.float32) for r in batch]),
+                    [Document(page_content=r["payload"].get("page_content", ""), metadata=r["payload"].get("metadata") or {}) for r in batch],
+                )
+            else:
+                groups: Dict[int, List[PointStruct]] = {}
+                for r in batch:
+                    source = (r["payload"].get("metadata") or {}).get("source")
+                    groups.setdefault(shard_index(source, len(clients)), []).append(
+                        PointStruct(id=r["id"], vector=_decode_vector(r["vector"]), payload=r["payload"])
+                    )
+                for index, points in groups.items():
+                    clients[index].upsert(collection_name=QDRANT_COLLECTION, points=points)
+            batch.clear()
+
+        point_count = 0
+        footer = None
+        for line in f:
+            record = json.loads(line)
+            kind = record.get("type")
+            if kind == "manifest":
+                t = validate_tenant_id(record["tenant_id"])
+                clear_tenant(t)
+                manifest = record["manifest"]
+                manifest.update({"mode": mode, "backend": backend, "status": "complete"})
+                # 新节点上还没有源文件：标记为 snapshot 条目，增量 ingest 时不会当作已删除文件清理；
+                # 之后拷贝过来的源文件 mtime 会变，增量 ingest 按 sha256 内容哈希识别为未变化
+                for entry in manifest.get("files", {}).values():
+                    entry["snapshot"] = True
+                if persist_manifest:
+                    save_manifest(t, manifest)
+                if manifest.get("parent_document"):
+                    get_docstore(t).clear()
+            elif kind == "docstore":
+                doc = record["document"]
+                get_docstore(record["tenant_id"]).mset(
+                    [(record["key"], Document(page_content=doc["page_content"], metadata=doc.get("metadata") or {}))]
+                )
+            elif kind == "point":
+                t = (record["payload"].get("metadata") or {}).get(TENANT_PAYLOAD_KEY)
+                if t:
+                    clear_tenant(t)
+                batch.append(record)
+                point_count += 1
+                if len(batch) >= SNAPSHOT_BATCH_SIZE:
+                    flush_batch()
+                if point_count % (SNAPSHOT_BATCH_SIZE * 40) == 0:
+                    yield f"Restored {point_count} points..."
+            elif kind == "footer":
+                footer = record
+        flush_batch()
+
+    if footer is None or footer.get("points") != point_count:
+        yield f"Warning: snapshot looks truncated ({point_count} points read, footer: {footer})."
+    yield f"Restore complete: {point_count} points, tenants: {sorted(cleared) or '-'}."
+    return store
+
+
+def _drain(generator: Generator[str, None, Any]) -> Any:
+    while True:
+        try:
+            print(next(generator))
+        except StopIteration as e:
+            return e.value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export / restore a knowledge base snapshot.")
+    parser.add_argument("action", choices=["export", "restore"])
+    parser.add_argument("path")
+    parser.add_argument("--mode", default="server", choices=["server", "disk", "memory"])
+    parser.add_argument("--tenant", default=None, help="export only this tenant's partition")
+    parser.add_argument("--skip-embedding-check", action="store_true", help="do not contact Ollama to verify the vector size")
+    args = parser.parse_args()
+
+    if args.action == "export":
+        _drain(export_snapshot(args.path, mode=args.mode, tenant_id=args.tenant))
+    else:
+        _drain(restore_snapshot(args.path, mode=args.mode, verify_embedding=not args.skip_embedding_check))
@@ -0,0 +1,109 @@
+# stub_ollama.py
+"""
+- 本地 Ollama 桩服务：实现 /api/tags、/api/embed、/api/chat，用于测试 / 压测 Ollama endpoint 池
+- 每个服务一把锁模拟单个 GPU 上的模型实例（embedding 串行执行，耗时 delay 秒）
+- fail=True 时 /api/embed、/api/chat 返回 500，模拟节点故障
+- 单独运行时在给定端口上各起一个服务（delay=50ms），再用 RAG_OLLAMA_ENDPOINTS 指向它们做 ingest 压测：
+    python tests/stub_ollama.py 18431 18432
+    RAG_OLLAMA_ENDPOINTS="http://127.0.0.1:18431,http://127.0.0.1:18432" python build_or_get_vectorstore_qrant.py
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+
+def stub_embedding(text: str) -> List[float]:
+    """确定性的向量，测试里用来核对结果顺序。"""
+    return [len(text) / 100.0, 1.0]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "StubOllama"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, status: int, obj: dict) -> None:
+        body = (json.dumps(obj) + "\n").encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/api/tags":
+            self._send(200, {"models": [{"name": m, "model": m} for m in self.server.models]})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.counter_lock:
+            self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+        if self.server.fail:
+            self._send(500, {"error": "stub failure"})
+            return
+        if request.get("model") not in self.server.models:
+            self._send(404, {"error": f"model '{request.get('model')}' not found"})
+            return
+        if self.path == "/api/embed":
+            with self.server.gpu:  # 单节点上 embedding 串行执行
+                time.sleep(self.server.delay)
+            inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            self._send(200, {"model": request["model"], "embeddings": [stub_embedding(t) for t in inputs]})
+        elif self.path == "/api/chat":
+            self._send(200, {
+                "model": request["model"],
+                "created_at": "2024-01-01T00:00:00Z",
+                "message": {"role": "assistant", "content": f"hi from {self.server.server_port}"},
+                "done": True,
+                "done_reason": "stop",
+            })
+        else:
+            self._send(404, {"error": "not found"})
+
+
+class StubOllama(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, models: Sequence[str] = ("stub",), delay: float = 0.0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.models = list(models)
+        self.delay = delay
+        self.fail = False
+        self.hits: dict = {}
+        self.counter_lock = threading.Lock()
+        self.gpu = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self) -> "StubOllama":
+        self._thread = threading.Thread(target=self.serve_forever, name=f"stub-ollama-{self.server_port}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from config import EMBEDDING_MODEL_NAME
+
+    ports = [int(p) for p in sys.argv[1:]] or [18431]
+    servers = [StubOllama(port, models=("stub", EMBEDDING_MODEL_NAME), delay=0.05).start() for port in ports]
+    print("Stub Ollama endpoints:", ",".join(s.url for s in servers))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for s in servers:
+            s.stop()
@@ -0,0 +1,143 @@
+# test_batching.py
+"""
+查询侧 micro-batching：并发提交的结果与逐条调用一致、确实合并成批、异常传给整批、worker 卡住时调用方超时。
+用 QdrantClient(":memory:") 代替 Qdrant 服务。在 backend 目录下运行：python -m unittest discover tests
+"""
+import hashlib
+import random
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as qmodels
+
+from batching import BatchedVectorStore, MicroBatcher, MicroBatchingEmbeddings
+
+COLLECTION = "batching_test"
+DIM = 16
+THREADS = 16
+
+
+class HashEmbeddings(Embeddings):
+    """确定性向量，并记录每次 embed_documents 的批大小。"""
+    def __init__(self):
+        self.batch_sizes: List[int] = []
+
+    def _vector(self, text: str) -> List[float]:
+        rng = random.Random(hashlib.md5(text.encode("utf-8")).digest())
+        return [rng.uniform(-1, 1) for _ in range(DIM)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.batch_sizes.append(len(texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+def _concurrently(fn, items: list) -> list:
+    """所有线程在同一时刻起跑，尽量让请求落进同一批。"""
+    barrier = threading.Barrier(len(items))
+
+    def call(item):
+        barrier.wait()
+        return fn(item)
+
+    with ThreadPoolExecutor(max_workers=len(items)) as pool:
+        return list(pool.map(call, items))
+
+
+class MicroBatcherTest(unittest.TestCase):
+    def test_concurrent_results_match_sequential(self):
+        batch_sizes: List[int] = []
+
+        def square_all(items: List[int]) -> List[int]:
+            batch_sizes.append(len(items))
+            time.sleep(0.01)
+            return [x * x for x in items]
+
+        batcher = MicroBatcher(square_all, max_batch_size=8, max_wait_ms=20)
+        items = list(range(THREADS * 2))
+        self.assertEqual(_concurrently(batcher.submit, items), [x * x for x in items])
+        self.assertLess(len(batch_sizes), len(items))  # 确实合并过
+        self.assertLessEqual(max(batch_sizes), 8)
+        self.assertEqual(sum(batch_sizes), len(items))
+
+    def test_error_is_raised_for_whole_batch(self):
+        def fail(items):
+            raise ValueError("boom")
+
+        batcher = MicroBatcher(fail, max_wait_ms=20)
+        results = _concurrently(lambda x: self.assertRaises(ValueError, batcher.submit, x), list(range(4)))
+        self.assertEqual(len(results), 4)
+
+        short = MicroBatcher(lambda items: items[:-1], max_wait_ms=1)
+        with self.assertRaises(RuntimeError):
+            short.submit(1)
+
+    def test_stuck_worker_times_out(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def stuck(items):
+            release.wait(5)
+            return items
+
+        batcher = MicroBatcher(stuck, max_wait_ms=1, timeout=0.1)
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            batcher.submit("q")
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class BatchedVectorStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.embeddings = HashEmbeddings()
+        client = QdrantClient(":memory:")
+        client.create_collection(COLLECTION, vectors_config=qmodels.VectorParams(size=DIM, distance=qmodels.Distance.COSINE))
+        self.store = QdrantVectorStore(client=client, collection_name=COLLECTION, embedding=self.embeddings)
+        self.store.add_documents([
+            Document(page_content=f"{source} chunk {i}", metadata={"source": source, "chunk": i})
+            for source in ("a.txt", "b.txt", "c.txt")
+            for i in range(20)
+        ])
+        self.embeddings.batch_sizes.clear()
+
+    def test_embeddings_match_unbatched(self):
+        batched = MicroBatchingEmbeddings(self.embeddings, max_batch_size=32, max_wait_ms=20)
+        queries = [f"question {i}" for i in range(THREADS)]
+        self.assertEqual(_concurrently(batched.embed_query, queries), [self.embeddings.embed_query(q) for q in queries])
+        self.assertLess(len(self.embeddings.batch_sizes), len(queries))
+
+    def test_concurrent_search_matches_unbatched(self):
+        batched = BatchedVectorStore(self.store, max_batch_size=32, max_wait_ms=20)
+        only_b = qmodels.Filter(must=[qmodels.FieldCondition(key="metadata.source", match=qmodels.MatchValue(value="b.txt"))])
+        # 不同 query / k / filter 混在同一批里，结果仍须各自对应
+        requests = [(f"chunk {i}", 1 + i % 7, only_b if i % 3 == 0 else None) for i in range(THREADS)]
+
+        def run(store, request):
+            query, k, query_filter = request
+            return [
+                (d.page_content, d.metadata, round(score, 5))
+                for d, score in store.similarity_search_with_score(query, k=k, filter=query_filter)
+            ]
+
+        expected = [run(self.store, r) for r in requests]
+        self.embeddings.batch_sizes.clear()
+        self.assertEqual(_concurrently(lambda r: run(batched, r), requests), expected)
+        self.assertLess(len(self.embeddings.batch_sizes), len(requests))
+        self.assertTrue(all(len(hits) == k for hits, (_, k, _) in zip(expected, requests)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+# test_chunker.py
+"""
+基于 token 的切分：多字节字符的字节偏移 -> 字符偏移、chunk 大小上限、overlap、分隔符切点、父子 chunk。
+用本地构造的小词表 tiktoken.Encoding 代替 gpt2，不需要下载词表。在 backend 目录下运行：python -m unittest discover tests
+"""
+import sys
+import unittest
+from bisect import bisect_left
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import tiktoken
+from langchain_core.documents import Document
+
+import chunker
+from chunker import TokenChunker, TokenizedText, split_parent_child
+
+ENCODING = "test-bytes"
+WORDS = ("vector", "search", "index", "tenant", "query", "the", "and", "of", "检索", "向量", "é")
+
+
+def _fake_encoding() -> tiktoken.Encoding:
+    """单字节 token + 少量整词合并：ASCII 单词是多字节 token，多数中文字符被拆成多个字节 token。"""
+    ranks = {bytes([i]): i for i in range(256)}
+    for word in WORDS:
+        for prefix in ("", " "):
+            data = (prefix + word).encode("utf-8")
+            for end in range(2, len(data) + 1):
+                ranks.setdefault(data[:end], len(ranks))
+    for sep in (b"\n\n", b". "):
+        ranks.setdefault(sep, len(ranks))
+    pat = r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+    return tiktoken.Encoding(name=ENCODING, pat_str=pat, mergeable_ranks=ranks, special_tokens={})
+
+
+FAKE = _fake_encoding()
+_patch = mock.patch.object(chunker, "get_encoder", lambda name=ENCODING: FAKE)
+
+
+def setUpModule():
+    _patch.start()
+
+
+def tearDownModule():
+    _patch.stop()
+
+
+def _text(paragraphs: int = 12) -> str:
+    sentences = [
+        "the vector index of tenant 检索 and query",
+        "向量检索 é café naïve 数据",
+        "search the index and the tenant",
+    ]
+    return "\n\n".join(
+        ". ".join(f"{sentences[(p + s) % 3]} {p}-{s}" for s in range(4)) + "." for p in range(paragraphs)
+    )
+
+
+def _expected_starts(text: str) -> list:
+    """逐 token 累加字节长度，再映射到“不早于该字节的第一个字符”。"""
+    char_bytes, offset = [], 0
+    for ch in text:
+        char_bytes.append(offset)
+        offset += len(ch.encode("utf-8"))
+    starts, offset = [], 0
+    for token in FAKE.encode_ordinary(text):
+        starts.append(bisect_left(char_bytes, offset))
+        offset += len(FAKE.decode_single_token_bytes(token))
+    return starts + [len(text)]
+
+
+class TokenizedTextTest(unittest.TestCase):
+    def test_ascii_offsets(self):
+        tok = TokenizedText("the vector index", ENCODING)
+        self.assertEqual(tok.num_tokens, 3)
+        self.assertEqual(tok.starts, [0, 3, 10, 16])
+
+    def test_multibyte_offsets(self):
+        text = "a检索b 向量 éx 数"  # “数”不在词表里，会被拆到多个字节 token 中
+        tok = TokenizedText(text, ENCODING)
+        self.assertEqual(tok.starts, _expected_starts(text))
+        # " 数" 被切成 b" \xe6" + 两个续字节：前者从空格开始，续字节 token 落到下一个完整字符（这里是末尾）
+        self.assertEqual(tok.starts[-4:], [len(text) - 2, len(text), len(text), len(text)])
+        self.assertEqual(tok.starts, sorted(tok.starts))
+        # 每个完整字符组成的 token 切出来就是它自己的字节
+        for i, token in enumerate(FAKE.encode_ordinary(text)):
+            piece = FAKE.decode_single_token_bytes(token)
+            try:
+                decoded = piece.decode("utf-8")
+            except UnicodeDecodeError:
+                continue
+            self.assertEqual(text[tok.starts[i]:tok.starts[i + 1]], decoded)
+
+    def test_long_mixed_text(self):
+        text = _text()
+        self.assertEqual(TokenizedText(text, ENCODING).starts, _expected_starts(text))
+
+
+class TokenChunkerTest(unittest.TestCase):
+    def test_overlap_must_be_smaller_than_size(self):
+        with self.assertRaises(ValueError):
+            TokenChunker(chunk_size=10, chunk_overlap=10, encoding_name=ENCODING)
+
+    def test_chunks_respect_limits_and_offsets(self):
+        text = _text()
+        for size, overlap in ((16, 0), (24, 6), (64, 12), (200, 40)):
+            splitter = TokenChunker(chunk_size=size, chunk_overlap=overlap, encoding_name=ENCODING)
+            chunks = splitter.split_text(text)
+            self.assertGreater(len(chunks), 1)
+            for chunk in chunks:
+                self.assertLessEqual(chunk.token_count, size)
+                self.assertEqual(chunk.token_count, chunk.token_end - chunk.token_start)
+                self.assertEqual(text[chunk.char_start:chunk.char_end], chunk.text)
+                self.assertEqual(chunk.text, chunk.text.strip())
+            # 没有丢内容：每个非空白字符都落在某个 chunk 里
+            covered = set()
+            for chunk in chunks:
+                covered.update(range(chunk.char_start, chunk.char_end))
+            self.assertTrue(all(i in covered for i, ch in enumerate(text) if not ch.isspace()))
+
+    def test_overlap(self):
+        text = _text()
+        tok = TokenizedText(text, ENCODING)
+
+        no_overlap = TokenChunker(chunk_size=24, chunk_overlap=0, encoding_name=ENCODING).split_spans(tok)
+        for (_, prev_end), (next_start, _) in zip(no_overlap, no_overlap[1:]):
+            self.assertEqual(next_start, prev_end)
+
+        spans = TokenChunker(chunk_size=24, chunk_overlap=6, encoding_name=ENCODING).split_spans(tok)
+        self.assertEqual(spans[0][0], 0)
+        self.assertEqual(spans[-1][1], tok.num_tokens)
+        overlaps = []
+        for (prev_start, prev_end), (next_start, _) in zip(spans, spans[1:]):
+            self.assertGreater(next_start, prev_start)  # 总能前进
+            self.assertLessEqual(prev_end - next_start, 6)
+            overlaps.append(prev_end - next_start)
+        self.assertTrue(any(o > 0 for o in overlaps))
+
+    def test_cut_prefers_paragraph_boundary(self):
+        paragraph = "the vector index of the tenant and the query"
+        text = f"{paragraph}\n\n{paragraph}\n\n{paragraph}"
+        tokens_per_paragraph = len(FAKE.encode_ordinary(paragraph + "\n\n"))
+        splitter = TokenChunker(chunk_size=tokens_per_paragraph + 4, chunk_overlap=0, encoding_name=ENCODING)
+        self.assertEqual([c.text for c in splitter.split_text(text)], [paragraph] * 3)
+
+    def test_split_documents_metadata(self):
+        splitter = TokenChunker(chunk_size=32, chunk_overlap=4, encoding_name=ENCODING)
+        text = _text(3)
+        docs = splitter.split_documents([Document(page_content=text, metadata={"source": "a.txt"})])
+        self.assertGreater(len(docs), 1)
+        for doc in docs:
+            self.assertEqual(doc.metadata["source"], "a.txt")
+            self.assertEqual(text[doc.metadata["char_start"]:doc.metadata["char_end"]], doc.page_content)
+            self.assertLessEqual(doc.metadata["token_count"], 32)
+
+
+class ParentChildTest(unittest.TestCase):
+    def test_children_stay_inside_parent(self):
+        text = _text()
+        parent = TokenChunker(chunk_size=96, chunk_overlap=0, encoding_name=ENCODING)
+        child = TokenChunker(chunk_size=20, chunk_overlap=4, encoding_name=ENCODING)
+        pairs = split_parent_child([Document(page_content=text, metadata={"source": "a.txt"})], parent, child)
+
+        self.assertEqual(len(pairs), len(parent.split_text(text)))
+        for parent_doc, children in pairs:
+            p_start, p_end = parent_doc.metadata["char_start"], parent_doc.metadata["char_end"]
+            self.assertEqual(text[p_start:p_end], parent_doc.page_content)
+            self.assertTrue(children)
+            for child_doc in children:
+                meta = child_doc.metadata
+                self.assertLessEqual(meta["token_count"], 20)
+                self.assertTrue(p_start <= meta["char_start"] < meta["char_end"] <= p_end)
+                self.assertEqual(text[meta["char_start"]:meta["char_end"]], child_doc.page_content)
+
+    def test_encodings_must_match(self):
+        with self.assertRaises(ValueError):
+            split_parent_child([], TokenChunker(encoding_name=ENCODING), TokenChunker(encoding_name="gpt2"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+# test_numpy_store.py
+"""
+NumPy 精确检索后端：追加中途崩溃后的恢复、tombstone 删除与 compact、带 filter 的 search_rows。
+在 backend 目录下运行：python -m unittest discover tests
+"""
+import hashlib
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from qdrant_client.http import models as qmodels
+
+from config import TENANT_PAYLOAD_KEY
+from numpy_store import NumpyVectorStore
+
+DIM = 8
+
+
+class HashEmbeddings(Embeddings):
+    def _vector(self, text: str) -> List[float]:
+        rng = random.Random(hashlib.md5(text.encode("utf-8")).digest())
+        return [rng.uniform(-1, 1) for _ in range(DIM)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+def _docs(tenant: str, source: str, n: int, start: int = 0) -> List[Document]:
+    return [
+        Document(page_content=f"{tenant} {source} {i}", metadata={TENANT_PAYLOAD_KEY: tenant, "source": source})
+        for i in range(start, start + n)
+    ]
+
+
+def _ids(docs: List[Document]) -> List[str]:
+    return [hashlib.md5(d.page_content.encode("utf-8")).hexdigest() for d in docs]
+
+
+def _match(key: str, *values: str) -> qmodels.FieldCondition:
+    return qmodels.FieldCondition(key=f"metadata.{key}", match=qmodels.MatchAny(any=list(values)))
+
+
+def _brute_force(store: NumpyVectorStore, query: List[float], k: int, rows: List[int]) -> List[int]:
+    vectors = np.asarray(store._vectors[: store.count], dtype=np.float32)
+    q = np.asarray(query, dtype=np.float32)
+    q /= np.linalg.norm(q)
+    scores = vectors[rows] @ q
+    return [rows[i] for i in np.argsort(-scores)[:k]]
+
+
+class NumpyStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.path = self.tmp / "store"
+        self.embeddings = HashEmbeddings()
+
+    def _open(self, **kwargs) -> NumpyVectorStore:
+        store, _ = NumpyVectorStore.open(self.embeddings, DIM, path=self.path, **kwargs)
+        return store
+
+    def _add(self, store: NumpyVectorStore, docs: List[Document]) -> None:
+        store.add_documents(docs, ids=_ids(docs))
+
+    def test_resume_after_partial_append(self):
+        store = self._open()
+        first = _docs("acme", "a.txt", 5)
+        self._add(store, first)
+
+        # 第二批写完向量 / ids / payload 后、写 meta 之前崩溃
+        second = _docs("acme", "b.txt", 4)
+        with mock.patch.object(NumpyVectorStore, "_save_meta", side_effect=OSError("crash")):
+            with self.assertRaises(OSError):
+                self._add(store, second)
+        del store
+
+        reopened = self._open()
+        self.assertEqual(reopened.count, 5)
+        ids_on_disk = (self.path / "ids.txt").read_text(encoding="utf-8").split()
+        self.assertEqual(ids_on_disk, _ids(first))
+
+        # 断点续传：重新写入同一批次
+        self._add(reopened, second)
+        self.assertEqual(reopened.live_count(), 9)
+        hits = reopened.similarity_search_with_score(second[2].page_content, k=1)
+        self.assertEqual(hits[0][0].page_content, second[2].page_content)
+        self.assertEqual(hits[0][0].metadata["_id"], _ids(second)[2])
+
+        reopened_again = self._open()
+        self.assertEqual(reopened_again.count, 9)
+        self.assertEqual(
+            {d.page_content for _, _, d in reopened_again.iter_records()},
+            {d.page_content for d in first + second},
+        )
+
+    def test_rewriting_same_ids_tombstones_old_rows(self):
+        store = self._open()
+        docs = _docs("acme", "a.txt", 6)
+        self._add(store, docs)
+        self._add(store, docs)
+        self.assertEqual(store.count, 12)
+        self.assertEqual(store.live_count(), 6)
+
+    def test_delete_and_compact(self):
+        store = self._open()
+        keep = _docs("acme", "keep.txt", 20)
+        drop = _docs("acme", "drop.txt", 20)
+        other = _docs("globex", "keep.txt", 10)
+        for docs in (keep, drop, other):
+            self._add(store, docs)
+
+        removed = store.delete_by_filter(qmodels.Filter(must=[_match(TENANT_PAYLOAD_KEY, "acme"), _match("source", "drop.txt")]))
+        self.assertEqual(removed, 20)
+        store.delete(_ids(keep)[:5])
+        self.assertEqual(store.live_count(), 25)
+
+        store.compact()
+        self.assertEqual(store.count, 25)
+        self.assertEqual(store.live_count(), 25)
+        self.assertFalse((self.tmp / "store.compact").exists())
+
+        reopened = self._open()
+        contents = {d.page_content for _, _, d in reopened.iter_records()}
+        self.assertEqual(contents, {d.page_content for d in keep[5:] + other})
+        # compact 后 ID 索引仍然有效：同一 ID 重新写入会替换旧行
+        self._add(reopened, keep[5:6])
+        self.assertEqual(reopened.live_count(), 25)
+
+    def test_filtered_search_rows_matches_brute_force(self):
+        store = NumpyVectorStore(self.embeddings, DIM, block_size=16)  # 内存模式，小 block 覆盖分块合并
+        for tenant in ("acme", "globex"):
+            for source in ("a.txt", "b.txt", "c.txt"):
+                self._add(store, _docs(tenant, source, 30))
+        store.delete(_ids(_docs("acme", "a.txt", 10)))
+
+        records = [store._read_record(row) for row in range(store.count)]
+        query = self.embeddings.embed_query("acme question")
+        cases = [
+            (None, lambda m: True),
+            (qmodels.Filter(must=[_match(TENANT_PAYLOAD_KEY, "acme")]), lambda m: m[TENANT_PAYLOAD_KEY] == "acme"),
+            (
+                qmodels.Filter(must=[_match(TENANT_PAYLOAD_KEY, "acme")], must_not=[_match("source", "b.txt")]),
+                lambda m: m[TENANT_PAYLOAD_KEY] == "acme" and m["source"] != "b.txt",
+            ),
+            (
+                qmodels.Filter(should=[_match("source", "a.txt"), _match("source", "c.txt")]),
+                lambda m: m["source"] in ("a.txt", "c.txt"),
+            ),
+            (qmodels.Filter(must=[_match(TENANT_PAYLOAD_KEY, "nobody")]), lambda m: False),
+        ]
+        for filter, predicate in cases:
+            rows = [
+                row for row, record in enumerate(records)
+                if not store._tombstones[row] and predicate(record["metadata"])
+            ]
+            for k in (1, 7, 50):
+                found = [row for row, _ in store.search_rows(query, k, filter)]
+                self.assertEqual(found, _brute_force(store, query, k, rows))
+
+    def test_unindexed_filter_field_is_rejected(self):
+        store = NumpyVectorStore(self.embeddings, DIM)
+        self._add(store, _docs("acme", "a.txt", 3))
+        with self.assertRaises(ValueError):
+            store.search_rows(self.embeddings.embed_query("x"), 3, qmodels.Filter(must=[_match("author", "bob")]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+# test_ollama_pool.py
+"""
+Ollama endpoint 池：最少在途选择、会话亲和、熔断 open / half-open / close、子批与缺模型时换节点重试。
+在 backend 目录下运行：python -m unittest discover tests
+"""
+import socket
+import sys
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import ollama
+
+from ollama_pool import NoHealthyEndpoint, OllamaPool, PooledChatOllama, PooledOllamaEmbeddings, normalize_url
+from stub_ollama import StubOllama, stub_embedding
+
+
+def _dead_url() -> str:
+    """一个当前没有服务监听的本地端口。"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+class SelectionTest(unittest.TestCase):
+    def test_least_outstanding(self):
+        pool = OllamaPool(["http://a:1", "http://b:1", "http://c:1"], health_interval=0)
+        first = pool.acquire()
+        second = pool.acquire()
+        third = pool.acquire()
+        self.assertEqual(len({first.url, second.url, third.url}), 3)
+
+        # 每个节点各一个在途请求；释放 third 后，下一个请求应落到 third 所在节点
+        pool.release(third, 0.01)
+        self.assertIs(pool.acquire(), third)
+        # 再来一个请求：所有节点都是 1 个在途，落到任意节点后变成 [1, 1, 2]
+        extra = pool.acquire()
+        busy = {ep.url: ep.outstanding for ep in pool.endpoints}
+        self.assertEqual(sorted(busy.values()), [1, 1, 2])
+        self.assertEqual(busy[extra.url], 2)
+        # 下一个请求不会再落到已有 2 个在途的节点
+        self.assertIsNot(pool.acquire(), extra)
+
+    def test_latency_breaks_ties(self):
+        pool = OllamaPool(["http://slow:1", "http://fast:1"], health_interval=0)
+        slow, fast = pool.endpoints
+        slow.latency_ewma, fast.latency_ewma = 0.5, 0.05
+        for _ in range(5):
+            ep = pool.acquire()
+            self.assertIs(ep, fast)
+            pool.release(ep, 0.05)
+
+    def test_affinity_pins_key_to_one_endpoint(self):
+        pool = OllamaPool([f"http://n{i}:1" for i in range(4)], health_interval=0)
+        for key in ("acme/s1", "acme/s2", "default/s1"):
+            pinned = pool.acquire(affinity=key)
+            # 即使该节点在途请求最多，同一个 key 仍落在同一节点
+            for _ in range(3):
+                self.assertIs(pool.acquire(affinity=key), pinned)
+            # 该节点不可用时迁移到另一个节点
+            self.assertIsNot(pool.acquire(exclude=[pinned], affinity=key), pinned)
+        self.assertGreater(len({pool.acquire(affinity=f"t/{i}").url for i in range(32)}), 1)
+
+    def test_default_port(self):
+        # 与 ollama.Client 解析 OLLAMA_HOST 的方式一致
+        self.assertEqual(normalize_url("0.0.0.0"), "http://0.0.0.0:11434")
+        self.assertEqual(normalize_url("gpu1"), "http://gpu1:11434")
+        self.assertEqual(normalize_url("http://gpu1:8080/"), "http://gpu1:8080")
+
+
+class CircuitTest(unittest.TestCase):
+    def test_open_half_open_close(self):
+        pool = OllamaPool(["http://a:1", "http://b:1"], failure_threshold=2, reset_timeout=0.2, health_interval=0)
+        a, b = pool.endpoints
+        error = ConnectionError("refused")
+
+        for _ in range(2):
+            pool.release(pool.acquire(exclude=[b]), 0.01, error)
+        self.assertEqual(a.state, "open")
+        # open 期间不会被选中
+        self.assertIs(pool.acquire(), b)
+        with self.assertRaises(NoHealthyEndpoint):
+            pool.acquire(exclude=[b])
+
+        # reset_timeout 之后放行一个试探请求，试探失败重新 open
+        time.sleep(0.25)
+        probe = pool.acquire(exclude=[b])
+        self.assertIs(probe, a)
+        self.assertEqual(a.state, "half_open")
+        with self.assertRaises(NoHealthyEndpoint):
+            pool.acquire(exclude=[b])  # half-open 时只放行一个请求
+        pool.release(probe, 0.01, error)
+        self.assertEqual(a.state, "open")
+
+        # 再次试探成功后 close
+        time.sleep(0.25)
+        probe = pool.acquire(exclude=[b])
+        pool.release(probe, 0.01)
+        self.assertEqual(a.state, "closed")
+        self.assertEqual(a.consecutive_failures, 0)
+
+    def test_client_errors_do_not_trip_circuit(self):
+        pool = OllamaPool(["http://a:1"], failure_threshold=1, health_interval=0)
+        pool.release(pool.acquire(), 0.01, ollama.ResponseError("model not found", 404))
+        self.assertEqual(pool.endpoints[0].state, "closed")
+
+    def test_half_open_probe_with_client_error_closes_circuit(self):
+        pool = OllamaPool(["http://a:1"], failure_threshold=1, reset_timeout=0.1, health_interval=0)
+        pool.release(pool.acquire(), 0.01, ConnectionError("refused"))
+        time.sleep(0.15)
+        probe = pool.acquire()
+        self.assertEqual(probe.state, "half_open")
+        # 404 说明节点可达：不能一直卡在 half_open
+        pool.release(probe, 0.01, ollama.ResponseError("model not found", 404))
+        self.assertEqual(probe.state, "closed")
+        self.assertIs(pool.acquire(), probe)
+
+    def test_health_check_recovers_endpoint(self):
+        stub = StubOllama().start()
+        self.addCleanup(stub.stop)
+        pool = OllamaPool([stub.url], failure_threshold=1, health_interval=0)
+        ep = pool.endpoints[0]
+        pool.release(pool.acquire(), 0.01, ConnectionError("refused"))
+        self.assertEqual(ep.state, "open")
+        pool.check_health()
+        self.assertEqual(ep.state, "closed")
+
+
+class StubEndpointTest(unittest.TestCase):
+    def setUp(self):
+        self.good = StubOllama(delay=0.01).start()
+        self.bad = StubOllama(delay=0.01).start()
+        self.bad.fail = True
+        self.addCleanup(self.good.stop)
+        self.addCleanup(self.bad.stop)
+
+    def test_sub_batches_retry_on_another_node(self):
+        pool = OllamaPool([self.good.url, self.bad.url], failure_threshold=100, health_interval=0)
+        embeddings = PooledOllamaEmbeddings(pool, "stub", sub_batch_size=4)
+        texts = [f"text {i} " * (i % 7 + 1) for i in range(64)]
+
+        vectors = embeddings.embed_documents(texts)
+
+        self.assertEqual(vectors, [stub_embedding(t) for t in texts])
+        self.assertGreater(self.bad.hits.get("/api/embed", 0), 0)  # 确实有子批先落到故障节点
+        self.assertEqual(self.good.hits["/api/embed"], 16)  # 16 个子批最终都由健康节点完成
+        bad_stats = next(s for s in pool.stats() if s["url"] == self.bad.url)
+        self.assertEqual(bad_stats["errors"], self.bad.hits["/api/embed"])
+
+    def test_dead_endpoint_fails_over(self):
+        pool = OllamaPool([self.good.url, _dead_url()], failure_threshold=2, health_interval=0)
+        embeddings = PooledOllamaEmbeddings(pool, "stub", sub_batch_size=4)
+        texts = [f"t{i}" for i in range(32)]
+        self.assertEqual(embeddings.embed_documents(texts), [stub_embedding(t) for t in texts])
+        self.assertEqual(pool.stats()[1]["state"], "open")
+
+    def test_generation_retries_only_connection_failures(self):
+        chat_pool = OllamaPool([_dead_url(), self.good.url], health_interval=0)
+        chat = PooledChatOllama(chat_pool, "stub")
+        for _ in range(3):
+            self.assertEqual(chat.invoke("hello").content, f"hi from {self.good.server_port}")
+
+        # 节点返回 500 时请求可能已到达模型，生成不是幂等的，不换节点重试
+        self.good.fail = True
+        failing = PooledChatOllama(OllamaPool([self.good.url, self.bad.url], health_interval=0), "stub")
+        with self.assertRaises(ollama.ResponseError):
+            failing.invoke("hello")
+        self.assertEqual(self.good.hits["/api/chat"] + self.bad.hits.get("/api/chat", 0), 4)
+
+    def test_missing_model_is_retried_on_another_node(self):
+        self.good.models = ["stub", "llama3"]
+        self.bad.fail = False  # bad 节点正常，但没有装 llama3
+        pool = OllamaPool([self.bad.url, self.good.url], health_interval=0)
+        chat = PooledChatOllama(pool, "llama3")
+        embeddings = PooledOllamaEmbeddings(pool, "llama3", sub_batch_size=2)
+        for _ in range(4):
+            self.assertEqual(chat.invoke("hello").content, f"hi from {self.good.server_port}")
+        texts = [f"t{i}" for i in range(8)]
+        self.assertEqual(embeddings.embed_documents(texts), [stub_embedding(t) for t in texts])
+        self.assertGreater(self.bad.hits.get("/api/chat", 0) + self.bad.hits.get("/api/embed", 0), 0)
+        self.assertEqual(pool.stats()[0]["state"], "closed")
+
+    def test_list_models_skips_unreachable(self):
+        self.good.models = ["stub", "llama3"]
+        pool = OllamaPool([self.good.url, _dead_url()], health_interval=0)
+        self.assertEqual(pool.list_models(), {self.good.url: ["stub", "llama3"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+# test_scheduler.py
+"""
+LLM 生成调度：interactive 预留槽位与优先出队、batch 被挤掉、429 / 503 / 504、取消时归还槽位、lane 数量上限。
+在 backend 目录下运行：python -m unittest discover tests
+"""
+import asyncio
+import sys
+import threading
+import unittest
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from scheduler import GenerationScheduler, SchedulerRejected
+
+MODEL = "llm"
+
+
+class SchedulerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.gates: List[threading.Event] = []
+        self.tasks: List[asyncio.Task] = []
+        self.order: List[str] = []
+
+    async def asyncTearDown(self):
+        for gate in self.gates:
+            gate.set()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def _job(self, name: str) -> threading.Event:
+        gate = threading.Event()
+        self.gates.append(gate)
+        return gate
+
+    def _start(self, scheduler: GenerationScheduler, name: str, priority: str = "interactive", **kwargs) -> asyncio.Task:
+        gate = self._job(name)
+
+        def work() -> str:
+            self.order.append(name)
+            gate.wait(5)
+            return name
+
+        task = asyncio.ensure_future(scheduler.run(kwargs.pop("model", MODEL), work, priority=priority, **kwargs))
+        task.gate = gate
+        self.tasks.append(task)
+        return task
+
+    @staticmethod
+    async def _settle() -> None:
+        await asyncio.sleep(0.05)
+
+    def _lane(self, scheduler: GenerationScheduler):
+        return scheduler._lanes[MODEL]
+
+    async def test_reserved_slot_is_kept_for_interactive(self):
+        scheduler = GenerationScheduler(max_concurrency=2, interactive_reserved=1)
+        batch_a = self._start(scheduler, "batch-a", "batch")
+        batch_b = self._start(scheduler, "batch-b", "batch")
+        await self._settle()
+        self.assertEqual(self.order, ["batch-a"])  # batch 只能用未预留的 1 个槽位
+
+        interactive = self._start(scheduler, "interactive")
+        await self._settle()
+        self.assertEqual(self.order, ["batch-a", "interactive"])
+        self.assertEqual(self._lane(scheduler).running, 2)
+
+        for task in (batch_a, interactive):
+            task.gate.set()
+        await self._settle()
+        self.assertEqual(self.order[-1], "batch-b")
+        batch_b.gate.set()
+        self.assertEqual(await batch_b, "batch-b")
+
+    async def test_interactive_dequeued_before_batch(self):
+        scheduler = GenerationScheduler(max_concurrency=1)
+        running = self._start(scheduler, "running")
+        await self._settle()
+        batch = self._start(scheduler, "batch", "batch")
+        await self._settle()
+        interactive = self._start(scheduler, "interactive")
+        await self._settle()
+
+        running.gate.set()
+        await self._settle()
+        self.assertEqual(self.order, ["running", "interactive"])
+        interactive.gate.set()
+        batch.gate.set()
+        await asyncio.gather(running, interactive, batch)
+        self.assertEqual(self.order, ["running", "interactive", "batch"])
+
+    async def test_interactive_evicts_newest_batch_when_queue_full(self):
+        scheduler = GenerationScheduler(max_concurrency=1, max_queue=2)
+        self._start(scheduler, "running")
+        await self._settle()
+        older = self._start(scheduler, "batch-1", "batch")
+        newer = self._start(scheduler, "batch-2", "batch")
+        await self._settle()
+
+        interactive = self._start(scheduler, "interactive")
+        await self._settle()
+        with self.assertRaises(SchedulerRejected) as ctx:
+            await newer
+        self.assertEqual(ctx.exception.status_code, 503)
+        self.assertFalse(older.done())
+        self.assertFalse(interactive.done())
+        self.assertEqual(scheduler.stats()["models"][MODEL]["evicted"], 1)
+
+    async def test_full_queues_return_429(self):
+        scheduler = GenerationScheduler(max_concurrency=1, max_queue=2, max_batch_queue=1)
+        self._start(scheduler, "running")
+        await self._settle()
+        self._start(scheduler, "batch-1", "batch")
+        await self._settle()
+        with self.assertRaises(SchedulerRejected) as ctx:
+            await self._start(scheduler, "batch-2", "batch")
+        self.assertEqual(ctx.exception.status_code, 429)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+        self._start(scheduler, "interactive-1")
+        await self._settle()  # 挤掉 batch-1
+        self._start(scheduler, "interactive-2")
+        await self._settle()
+        with self.assertRaises(SchedulerRejected) as ctx:
+            await self._start(scheduler, "interactive-3")  # 队列已满且没有 batch 可挤
+        self.assertEqual(ctx.exception.status_code, 429)
+
+    async def test_deadline_rejections(self):
+        scheduler = GenerationScheduler(max_concurrency=1)
+        running = self._start(scheduler, "running")
+        await self._settle()
+
+        # 预计等待（service_ewma 默认 5 秒）超过 deadline：入队前就拒绝
+        with self.assertRaises(SchedulerRejected) as ctx:
+            await self._start(scheduler, "hopeless", deadline_ms=100)
+        self.assertEqual(ctx.exception.status_code, 503)
+
+        # 入队时估计来得及，但排队期间过期
+        self._lane(scheduler).service_ewma = 0.01
+        with self.assertRaises(SchedulerRejected) as ctx:
+            await self._start(scheduler, "expires", deadline_ms=100)
+        self.assertEqual(ctx.exception.status_code, 504)
+        self.assertNotIn("expires", self.order)
+
+        running.gate.set()
+        await running
+        self.assertEqual(self._lane(scheduler).running, 0)
+        self.assertEqual(self._lane(scheduler).queued, {"interactive": 0, "batch": 0})
+
+    async def test_cancel_releases_slot(self):
+        scheduler = GenerationScheduler(max_concurrency=1)
+        running = self._start(scheduler, "running")
+        await self._settle()
+        queued = self._start(scheduler, "queued")
+        await self._settle()
+
+        # 排队中取消：直接出队
+        queued.cancel()
+        await self._settle()
+        self.assertEqual(self._lane(scheduler).queued["interactive"], 0)
+
+        # 执行中取消：线程里的生成还在跑，槽位等它结束才归还
+        running.cancel()
+        await self._settle()
+        self.assertEqual(self._lane(scheduler).running, 1)
+        running.gate.set()
+        await self._settle()
+        self.assertEqual(self._lane(scheduler).running, 0)
+
+        after = self._start(scheduler, "after")
+        await self._settle()
+        self.assertEqual(self.order, ["running", "after"])
+        after.gate.set()
+        await after
+
+    async def test_lane_count_is_bounded(self):
+        scheduler = GenerationScheduler(max_concurrency=1, max_lanes=2)
+        first = self._start(scheduler, "a", model="m1")
+        second = self._start(scheduler, "b", model="m2")
+        await self._settle()
+        with self.assertRaises(SchedulerRejected) as ctx:
+            await self._start(scheduler, "c", model="m3")
+        self.assertEqual(ctx.exception.status_code, 503)
+
+        first.gate.set()
+        await first
+        third = self._start(scheduler, "c", model="m3")  # m1 空闲，被回收
+        await self._settle()
+        self.assertEqual(set(scheduler._lanes), {"m2", "m3"})
+        for task in (second, third):
+            task.gate.set()
+        await asyncio.gather(second, third)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# test_sessions.py
+"""
+会话存储：按 tenant 隔离、只有最近一轮保留完整检索结果、LRU / TTL 淘汰。
+在 backend 目录下运行：python -m unittest discover tests
+"""
+import sys
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sessions import SessionStore, Turn
+
+
+def _turn(query: str) -> Turn:
+    return Turn(
+        query=query,
+        query_vector=[1.0, 0.0],
+        results=[{"doc": None, "score": 1.0, "payload": {"source": f"{query}.txt"}}],
+        answer=f"answer to {query}",
+        chunk_ids=[f"{query}-chunk"],
+    )
+
+
+class SessionStoreTest(unittest.TestCase):
+    def test_sessions_are_isolated_per_tenant(self):
+        store = SessionStore()
+        acme = store.get_or_create("acme", "s1")
+        acme.add_turn(_turn("secret"))
+        other = store.get_or_create("default", "s1")
+        self.assertIsNot(acme, other)
+        self.assertFalse(other.turns)
+
+        self.assertFalse(store.delete("default", "missing"))
+        self.assertTrue(store.delete("default", "s1"))
+        self.assertEqual(len(store.get_or_create("acme", "s1").turns), 1)
+
+    def test_only_last_turn_keeps_results(self):
+        session = SessionStore(max_turns=4).get_or_create("default", "s1")
+        for query in ("q1", "q2", "q3"):
+            session.add_turn(_turn(query))
+        older, last = list(session.turns)[:-1], session.last_turn
+        self.assertTrue(all(t.results == [] and t.query_vector == [] for t in older))
+        self.assertEqual([t.chunk_ids for t in older], [["q1-chunk"], ["q2-chunk"]])
+        self.assertEqual(len(last.results), 1)
+        self.assertEqual(last.query_vector, [1.0, 0.0])
+
+    def test_lru_and_ttl_eviction(self):
+        store = SessionStore(max_sessions=2, ttl_seconds=0.2)
+        store.get_or_create("t", "a")
+        store.get_or_create("t", "b")
+        store.get_or_create("t", "a")  # a 变为最近使用
+        store.get_or_create("t", "c")  # 淘汰 b
+        self.assertFalse(store.delete("t", "b"))
+        time.sleep(0.25)
+        store.get_or_create("t", "d")  # 过期的 a / c 被清理
+        self.assertEqual(len(store), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+# test_sharding.py
+"""
+客户端分片路由：按 source 分区写入、scatter-gather 合并后的 top-k 与单实例一致、故障分片被跳过。
+用多个 QdrantClient(":memory:") 模拟独立实例。在 backend 目录下运行：python -m unittest discover tests
+"""
+import hashlib
+import random
+import sys
+import unittest
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as qmodels
+
+from sharding import ShardedVectorStore, shard_index
+
+COLLECTION = "sharding_test"
+DIM = 16
+
+
+class HashEmbeddings(Embeddings):
+    """由文本哈希播种的确定性随机向量，分数几乎不会相同，便于逐条比较排序。"""
+    def _vector(self, text: str) -> List[float]:
+        rng = random.Random(hashlib.md5(text.encode("utf-8")).digest())
+        return [rng.uniform(-1, 1) for _ in range(DIM)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+def _store(embeddings: Embeddings) -> QdrantVectorStore:
+    client = QdrantClient(":memory:")
+    client.create_collection(COLLECTION, vectors_config=qmodels.VectorParams(size=DIM, distance=qmodels.Distance.COSINE))
+    return QdrantVectorStore(client=client, collection_name=COLLECTION, embedding=embeddings)
+
+
+def _documents() -> List[Document]:
+    return [
+        Document(page_content=f"{name} chunk {i}", metadata={"source": name, "chunk": i})
+        for name in (f"file_{n}.txt" for n in range(12))
+        for i in range(10)
+    ]
+
+
+class _FailingShard:
+    def similarity_search_with_score_by_vector(self, *args, **kwargs):
+        raise ConnectionError("shard unavailable")
+
+
+class ShardedVectorStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.embeddings = HashEmbeddings()
+        self.shards = [_store(self.embeddings) for _ in range(3)]
+        self.sharded = ShardedVectorStore(self.shards, self.embeddings)
+        self.single = _store(self.embeddings)
+        docs = _documents()
+        self.sharded.add_documents(docs)
+        self.single.add_documents(docs)
+
+    def _sources(self, shard: QdrantVectorStore) -> set:
+        points, _ = shard.client.scroll(COLLECTION, limit=1000, with_payload=True)
+        return {p.payload["metadata"]["source"] for p in points}
+
+    def test_shard_index_is_stable(self):
+        self.assertEqual(shard_index("a.txt", 4), shard_index("a.txt", 4))
+        # 只差一个字符的文件名也应分散到不同分片
+        self.assertGreater(len({shard_index(f"{c}.txt", 2) for c in "abcdefgh"}), 1)
+
+    def test_points_partitioned_by_source(self):
+        seen = set()
+        for index, shard in enumerate(self.shards):
+            sources = self._sources(shard)
+            self.assertTrue(sources, f"shard {index} received no points")
+            self.assertTrue(all(shard_index(s, len(self.shards)) == index for s in sources))
+            self.assertFalse(sources & seen)  # 同一文件的 chunk 只落在一个分片
+            seen |= sources
+        total = sum(s.client.count(COLLECTION).count for s in self.shards)
+        self.assertEqual(total, len(_documents()))
+
+    def test_merged_top_k_matches_single_store(self):
+        for query in ("file_3 chunk 7", "alpha", "chunk 0", "something else entirely"):
+            for k in (1, 5, 20):
+                sharded = self.sharded.similarity_search_with_score(query, k=k)
+                single = self.single.similarity_search_with_score(query, k=k)
+                self.assertEqual(
+                    [(d.page_content, round(s, 5)) for d, s in sharded],
+                    [(d.page_content, round(s, 5)) for d, s in single],
+                )
+
+    def test_filter_is_applied_on_every_shard(self):
+        condition = qmodels.Filter(must=[
+            qmodels.FieldCondition(key="metadata.source", match=qmodels.MatchAny(any=["file_1.txt", "file_8.txt"]))
+        ])
+        results = self.sharded.similarity_search_with_score("chunk", k=30, filter=condition)
+        self.assertEqual(len(results), 20)
+        self.assertEqual({d.metadata["source"] for d, _ in results}, {"file_1.txt", "file_8.txt"})
+
+    def test_failing_shard_is_skipped(self):
+        healthy = ShardedVectorStore([self.shards[0], _FailingShard(), self.shards[2]], self.embeddings)
+        results = healthy.similarity_search_with_score("file_3 chunk 7", k=50)
+
+        expected_sources = self._sources(self.shards[0]) | self._sources(self.shards[2])
+        self.assertTrue(results)
+        self.assertEqual({d.metadata["source"] for d, _ in results}, expected_sources)
+        scores = [s for _, s in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+
+if __name__ == "__main__":
+    unittest.main()